@@ -0,0 +1,164 @@
+"""
+Файл: bench_process_sources.py
+
+Бенчмарк источников процессов (psutil vs прямое чтение /proc) на синтетической
+таблице процессов. Строит во временном каталоге фиктивный /proc на N процессов,
+направляет туда оба источника (psutil — через psutil.PROCFS_PATH), проверяет,
+что снимки совпадают, и замеряет полный, установившийся и «churn»-проходы сканера.
+
+Только Linux.
+
+Запуск:
+    python bench_process_sources.py --processes 5000 --churn 50 --repeat 5
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import psutil
+
+from process_scanner import ProcessScanner
+from process_sources import ProcfsProcessSource, PsutilProcessSource
+
+FIRST_PID = 100000
+NAMES = [
+    'game.exe', 'minecraft.exe', 'robloxplayerbeta.exe', 'javaw', 'bash', 'python3',
+    'systemd-journald', 'gnome-shell-calendar-server', 'Animal Revolt Battle Simulator.exe',
+    'kworker/0:1', 'chrome', 'code', 'pulseaudio', 'xdg-desktop-portal-gtk',
+]
+
+
+def _real_boot_time():
+    with open('/proc/stat', 'rb') as f:
+        for line in f:
+            if line.startswith(b'btime'):
+                return int(line.split()[1])
+    return 0
+
+
+def _write_process(root, pid, rnd):
+    full_name = rnd.choice(NAMES)
+    comm = full_name[:15]
+    pdir = os.path.join(root, str(pid))
+    os.mkdir(pdir)
+    starttime = rnd.randint(1000, 10_000_000)
+    fields = ['S', '1', str(pid), str(pid), '0', '-1', '4194560'] + ['0'] * 12 + [str(starttime)] + ['0'] * 30
+    with open(os.path.join(pdir, 'stat'), 'w', encoding='utf-8') as f:
+        f.write(f"{pid} ({comm}) {' '.join(fields)}\n")
+    with open(os.path.join(pdir, 'comm'), 'w', encoding='utf-8') as f:
+        f.write(comm + '\n')
+    exe = f"/opt/games/{full_name}"
+    with open(os.path.join(pdir, 'cmdline'), 'w', encoding='utf-8') as f:
+        f.write(exe + '\x00--synthetic\x00')
+    os.symlink(exe, os.path.join(pdir, 'exe'))
+
+
+def build_fake_procfs(count, seed=1):
+    root = tempfile.mkdtemp(prefix='fake_proc_')
+    with open(os.path.join(root, 'stat'), 'w', encoding='utf-8') as f:
+        f.write(f"cpu  0 0 0 0 0 0 0 0 0 0\nbtime {_real_boot_time()}\n")
+    rnd = random.Random(seed)
+    for i in range(count):
+        _write_process(root, FIRST_PID + i, rnd)
+    return root, rnd
+
+
+def churn(root, rnd, pids, count):
+    """Удаляет count случайных процессов и добавляет столько же новых."""
+    for pid in rnd.sample(sorted(pids), count):
+        shutil.rmtree(os.path.join(root, str(pid)))
+        pids.discard(pid)
+    next_pid = max(pids) + 1 if pids else FIRST_PID
+    for i in range(count):
+        _write_process(root, next_pid + i, rnd)
+        pids.add(next_pid + i)
+
+
+def snapshot_of(scanner):
+    """Нормализованный снимок: {pid: (name, create_time, exe)}."""
+    return {
+        pid: (entry.name, round(entry.create_time, 2), scanner.exe(entry))
+        for pid, entry in scanner.entries().items()
+    }
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(count, churn_count, repeat):
+    root, rnd = build_fake_procfs(count)
+    saved_procfs = psutil.PROCFS_PATH
+    psutil.PROCFS_PATH = root
+    try:
+        sources = {
+            'psutil': PsutilProcessSource,
+            'procfs': lambda: ProcfsProcessSource(root=root),
+        }
+        results = {'processes': count, 'churn': churn_count, 'repeat': repeat, 'backends': {}}
+        snapshots = {}
+        for name, factory in sources.items():
+            full = timed(lambda: ProcessScanner(factory(), reuse_check_batch=0).scan(), repeat)
+            scanner = ProcessScanner(factory(), reuse_check_batch=0)
+            scanner.scan()
+            steady = timed(scanner.scan, repeat)
+            snapshots[name] = snapshot_of(scanner)
+            results['backends'][name] = {'full_scan_ms': full * 1000, 'steady_scan_ms': steady * 1000}
+
+        if snapshots['psutil'] != snapshots['procfs']:
+            diff = [pid for pid in snapshots['psutil'] if snapshots['psutil'][pid] != snapshots['procfs'].get(pid)]
+            raise SystemExit(f"Snapshots differ for {len(diff)} PIDs, e.g. {diff[:5]}")
+        results['identical_snapshots'] = True
+
+        # Churn: одинаковые изменения таблицы для обоих сканеров
+        scanners = {name: ProcessScanner(factory(), reuse_check_batch=0) for name, factory in sources.items()}
+        for scanner in scanners.values():
+            scanner.scan()
+        pids = set(range(FIRST_PID, FIRST_PID + count))
+        churn_times = {name: [] for name in scanners}
+        for _ in range(repeat):
+            churn(root, rnd, pids, churn_count)
+            for name, scanner in scanners.items():
+                start = time.perf_counter()
+                scanner.scan()
+                churn_times[name].append(time.perf_counter() - start)
+        for name, times in churn_times.items():
+            results['backends'][name]['churn_scan_ms'] = min(times) * 1000
+        if snapshot_of(scanners['psutil']) != snapshot_of(scanners['procfs']):
+            raise SystemExit("Snapshots differ after churn")
+        return results
+    finally:
+        psutil.PROCFS_PATH = saved_procfs
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if not sys.platform.startswith('linux'):
+        raise SystemExit("bench_process_sources.py requires Linux")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=5000)
+    parser.add_argument('--churn', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='записать результаты в JSON-файл')
+    args = parser.parse_args()
+
+    results = run(args.processes, args.churn, args.repeat)
+    for name, res in results['backends'].items():
+        print(f"{name:>7}: full {res['full_scan_ms']:8.1f} ms | steady {res['steady_scan_ms']:7.2f} ms | "
+              f"churn({args.churn}) {res['churn_scan_ms']:7.2f} ms")
+    print("snapshots identical: yes")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,302 @@
+"""
+Файл: bench_usage_storage.py
+
+Бенчмарк хранилища статистики на синтетической истории. Заполняет хранилище
+(sqlite во временном каталоге или memory) историей из N строк по многим играм:
+сэмплы каждые --interval секунд, популярность игр по закону Ципфа, одна сессия
+на игру в день. Затем замеряет поток записи через log_usage + flush (путь
+приложения: журнал, очередь, поток-писатель), задержку каждого метода
+запросов ProcessManager — холодную (пустой кэш) и тёплую, время выгрузки
+и загрузки всей истории (с проверкой, что после сброса базы загрузка возвращает те же
+минутные карты и сумму секунд), размер БД и время очистки по политике хранения.
+
+Результаты пишутся в JSON, чтобы сравнивать версии между собой.
+
+Запуск:
+    python bench_usage_storage.py --rows 1000 100000 1000000 --games 50 --json bench.json
+    python bench_usage_storage.py --rows 10000000 --storage sqlite
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from process_manager import ProcessManager
+from usage_storage import create_usage_storage, day_key
+
+LOAD_BATCH = 20000
+
+
+class BenchSettings:
+    """Минимальная замена SettingsManager: get(), путь к файлу настроек и подписки (настройки не меняются)."""
+
+    def __init__(self, values, filename):
+        self._values = values
+        self.filename = filename
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def subscribe(self, keys, callback):
+        return callback
+
+    def unsubscribe(self, callback):
+        pass
+
+
+def game_names(count):
+    return [f"game_{i:03d}.exe" for i in range(count)]
+
+
+def synthetic_history(rows, names, interval, end_ts, seed=1):
+    """Генерирует пачки (samples, session_ops) в порядке времени, не держа историю в памяти.
+    В каждый момент времени играют несколько игр, поэтому история занимает rows * interval / len(names) секунд.
+    """
+    rnd = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(names))]
+    step = interval / len(names)
+    ts = end_ts - rows * step
+    samples = []
+    session_ops = []
+    day = None
+    day_sessions = {}  # name -> [first_ts, last_ts]
+    for _ in range(rows):
+        ts += step
+        now = int(ts + rnd.uniform(-step / 2, step / 2))
+        when = datetime.fromtimestamp(now)
+        key = day_key(when)
+        if key != day:
+            for name, (first, last) in day_sessions.items():
+                session_ops.append(('session_open', (name, first)))
+                session_ops.append(('session_close', (name, last)))
+            day_sessions = {}
+            day = key
+        name = rnd.choices(names, weights)[0]
+        samples.append((now, key, name, int(interval)))
+        span = day_sessions.setdefault(name, [now, now])
+        span[1] = now
+        if len(samples) >= LOAD_BATCH:
+            yield samples, session_ops
+            samples, session_ops = [], []
+    for name, (first, last) in day_sessions.items():
+        session_ops.append(('session_open', (name, first)))
+        session_ops.append(('session_close', (name, last)))
+    yield samples, session_ops
+
+
+def storage_size(storage):
+    if storage.path is None:
+        return None
+    return sum(os.path.getsize(storage.path + suffix)
+               for suffix in ('', '-wal', '-shm') if os.path.exists(storage.path + suffix))
+
+
+def raw_rows(storage):
+    """Число сырых строк usage_stats в хранилище."""
+    if storage.path is None:
+        return len(storage)
+    conn = sqlite3.connect(storage.path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM usage_stats').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def timed(fn, repeat):
+    """Лучшее из repeat время вызова fn (мс)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def query_cases(manager, first_day, today, workdir):
+    """Методы запросов ProcessManager с типичными аргументами: имя -> callable."""
+    yesterday = today - timedelta(days=1)
+    week_start = today - timedelta(days=today.weekday())
+    month_ago = today - timedelta(days=30)
+    end = today + timedelta(days=1)
+    return {
+        'get_daily_usage_today': lambda: manager.get_daily_usage(),
+        'get_daily_usage_past_day': lambda: manager.get_daily_usage(yesterday),
+        'get_daily_play_seconds_today': lambda: manager.get_daily_play_seconds(),
+        'get_daily_play_seconds_past_day': lambda: manager.get_daily_play_seconds(yesterday),
+        'get_weekly_usage': lambda: manager.get_weekly_usage(week_start),
+        'get_usage_by_process_today': lambda: manager.get_usage_by_process(),
+        'get_usage_by_process_past_day': lambda: manager.get_usage_by_process(yesterday),
+        'get_usage_by_process_range_30d': lambda: manager.get_usage_by_process_range(month_ago, end),
+        'get_usage_by_process_range_all': lambda: manager.get_usage_by_process_range(first_day, end),
+        'get_hourly_usage_day': lambda: manager.get_hourly_usage(yesterday, today),
+        'get_hourly_usage_30d': lambda: manager.get_hourly_usage(month_ago, end),
+        'get_last_seen_and_sessions_7d': lambda: manager.get_last_seen_and_sessions(today - timedelta(days=6), end),
+        'get_dashboard_stats': lambda: manager.get_dashboard_stats(),
+        'get_minute_usage_today': lambda: manager.get_minute_usage(),
+        'get_minute_usage_past_day': lambda: manager.get_minute_usage(yesterday),
+        'get_play_patterns_30d': lambda: manager.get_play_patterns(month_ago, end),
+        'get_play_patterns_365d': lambda: manager.get_play_patterns(today - timedelta(days=364), end),
+        'export_usage_30d': lambda: manager.export_usage(os.path.join(workdir, 'export_30d.csv'), month_ago, end),
+    }
+
+
+def run(kind, rows, games, interval, inserts, repeat, retention_days, hourly_retention_days, workdir):
+    names = game_names(games)
+    path = os.path.join(workdir, f"bench_{kind}_{rows}.db")
+    storage = create_usage_storage(kind, path)
+    result = {'storage': kind, 'rows': rows, 'games': games, 'interval_sec': interval}
+
+    # Загрузка истории напрямую в хранилище (минуя очередь), пачками по LOAD_BATCH строк
+    start = time.perf_counter()
+    session_ids = {}
+    first_ts = None
+    for samples, session_ops in synthetic_history(rows, names, interval, time.time() - 86400):
+        if first_ts is None and samples:
+            first_ts = samples[0][0]
+        session_ids = storage.write(samples, session_ops, session_ids)
+    storage.close_writer()  # поток-писатель откроет своё соединение
+    elapsed = time.perf_counter() - start
+    result['load'] = {'seconds': round(elapsed, 3), 'rows_per_sec': round(rows / elapsed) if elapsed else None}
+    result['size_bytes'] = storage_size(storage)
+
+    settings = BenchSettings({
+        'processes': names,
+        'usage_storage': kind,
+        'usage_db_path': path,
+        'usage_retention_days': retention_days,
+        'usage_hourly_retention_days': hourly_retention_days,
+    }, os.path.join(workdir, 'settings.json'))
+    manager = ProcessManager(settings, storage=storage)
+    try:
+        # Поток записи через путь приложения: журнал + очередь + транзакции писателя.
+        # Вызовы для той же игры в ту же секунду заменяют строку (ts, process_name), поэтому
+        # скорость считается по строкам, которые действительно добавились в хранилище
+        rows_before = raw_rows(storage)
+        start = time.perf_counter()
+        for i in range(inserts):
+            manager.log_usage(names[i % games], 1)
+        submitted = time.perf_counter() - start
+        if not manager.flush(timeout=120.0):
+            raise SystemExit("Usage writer did not flush in time")
+        elapsed = time.perf_counter() - start
+        committed = raw_rows(storage) - rows_before
+        result['log_usage'] = {
+            'calls': inserts,
+            'rows_committed': committed,
+            'submit_us_per_call': round(submitted / inserts * 1e6, 2) if inserts else None,
+            'rows_per_sec': round(committed / elapsed) if elapsed else None,
+        }
+
+        first_day = datetime.fromtimestamp(first_ts).date() if first_ts else datetime.now().date()
+        queries = {}
+        for name, fn in query_cases(manager, first_day, datetime.now().date(), workdir).items():
+            cold = None
+            for _ in range(repeat):
+                manager._range_cache.clear()
+                elapsed = timed(fn, 1)
+                cold = elapsed if cold is None else min(cold, elapsed)
+            queries[name] = {'cold_ms': round(cold, 3), 'warm_ms': round(timed(fn, repeat), 4)}
+        result['queries'] = queries
+
+        start = time.perf_counter()
+        report = manager.cleanup_old_data()
+        result['cleanup'] = {'seconds': round(time.perf_counter() - start, 3), 'report': report}
+        result['size_after_cleanup_bytes'] = storage_size(storage)
+
+        # Круговая проверка: полная выгрузка, сброс базы, загрузка файла обратно. Дни с сырыми записями
+        # должны вернуть те же минутные карты, вся история — ту же сумму секунд. Минуты свёрнутых дней
+        # в файл не попадают и восстанавливаются по почасовым суммам лишь приблизительно, их не сравниваем
+        today = datetime.now().date()
+        raw_from = today - timedelta(days=retention_days) if retention_days else first_day
+        raw_days = [day_key(max(first_day, raw_from) + timedelta(days=i))
+                    for i in range((today - max(first_day, raw_from)).days + 1)]
+        minutes_before = {day: storage.day_minutes(day) for day in raw_days}
+        total_before = storage.range_total(day_key(first_day), day_key(today) + 1)
+        export_path = os.path.join(workdir, f"export_{kind}_{rows}.csv")
+        start = time.perf_counter()
+        exported = manager.export_usage(export_path)
+        export_seconds = time.perf_counter() - start
+        manager.reset_database()
+        start = time.perf_counter()
+        imported = manager.import_usage(export_path) or {}
+        import_seconds = time.perf_counter() - start
+        result['export_import'] = {
+            'rows': exported,
+            'file_bytes': os.path.getsize(export_path) if os.path.exists(export_path) else None,
+            'export_seconds': round(export_seconds, 3),
+            'import_seconds': round(import_seconds, 3),
+            'imported_rows': imported.get('rows'),
+            'skipped_rows': imported.get('skipped'),
+            'minutes_match': all(storage.day_minutes(day) == bits for day, bits in minutes_before.items()),
+            'seconds_match': storage.range_total(day_key(first_day), day_key(today) + 1) == total_before,
+        }
+    finally:
+        manager.close()
+    return result
+
+
+def print_result(result):
+    size = result['size_bytes']
+    after = result['size_after_cleanup_bytes']
+    print(f"\n[{result['storage']}] {result['rows']:,} rows, {result['games']} games")
+    print(f"  load       {result['load']['seconds']:9.2f} s  ({result['load']['rows_per_sec']:,} rows/s)")
+    print(f"  log_usage  {result['log_usage']['submit_us_per_call']:9.2f} us/call, "
+          f"{result['log_usage']['rows_per_sec']:,} rows/s committed "
+          f"({result['log_usage']['rows_committed']:,} of {result['log_usage']['calls']:,} calls)")
+    for name, res in result['queries'].items():
+        print(f"  {name:<32} cold {res['cold_ms']:9.3f} ms | warm {res['warm_ms']:8.4f} ms")
+    transfer = result['export_import']
+    print(f"  export     {transfer['export_seconds']:9.2f} s  ({transfer['rows']} rows) | "
+          f"import {transfer['import_seconds']:.2f} s | round trip: minutes "
+          f"{'ok' if transfer['minutes_match'] else 'MISMATCH'}, seconds {'ok' if transfer['seconds_match'] else 'MISMATCH'}")
+    print(f"  cleanup    {result['cleanup']['seconds']:9.2f} s")
+    if size is not None:
+        print(f"  size       {size / 2 ** 20:9.2f} MB -> {after / 2 ** 20:.2f} MB after cleanup")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--interval', type=int, default=600, help='шаг сэмплов одной игры, секунд')
+    parser.add_argument('--storage', choices=['sqlite', 'memory', 'both'], default='both')
+    parser.add_argument('--inserts', type=int, default=10000, help='число вызовов log_usage')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--retention-days', type=int, default=30)
+    parser.add_argument('--hourly-retention-days', type=int, default=365)
+    parser.add_argument('--keep', action='store_true', help='не удалять временный каталог с БД')
+    parser.add_argument('--json', help='записать результаты в JSON-файл')
+    args = parser.parse_args()
+
+    kinds = ['sqlite', 'memory'] if args.storage == 'both' else [args.storage]
+    workdir = tempfile.mkdtemp(prefix='bench_usage_')
+    results = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'runs': [],
+    }
+    try:
+        for rows in args.rows:
+            for kind in kinds:
+                result = run(kind, rows, args.games, args.interval, args.inserts, args.repeat,
+                             args.retention_days, args.hourly_retention_days, workdir)
+                results['runs'].append(result)
+                print_result(result)
+    finally:
+        if args.keep:
+            print(f"\nDatabases kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
@@ -2,7 +2,6 @@
 Главный модуль приложения Game Timer.
 """
 import sys
-import os
 import logging
 import ctypes
 import time
@@ -171,7 +170,8 @@ class GUIManager(QtWidgets.QWidget):
 
         self.tabs.addTab(main_tab, "Главная")
 
-        # --- Вкладка Статистика игр ---
+        # --- Вкладка Статистика игр (подвкладки: по играм и закономерности) ---
+        self.stats_tabs = QtWidgets.QTabWidget()
         stats_tab = QtWidgets.QWidget()
         stats_tab_layout = QtWidgets.QVBoxLayout(stats_tab)
         period_layout = QtWidgets.QHBoxLayout()
@@ -189,8 +189,43 @@ class GUIManager(QtWidgets.QWidget):
 
         self.btn_today.clicked.connect(lambda: self.update_per_game_stats(self.process_manager, period='today'))
         self.btn_week.clicked.connect(lambda: self.update_per_game_stats(self.process_manager, period='week'))
-
-        self.tabs.addTab(stats_tab, "Статистика игр")
+        self.stats_tabs.addTab(stats_tab, "По играм")
+
+        patterns_tab = QtWidgets.QWidget()
+        patterns_layout = QtWidgets.QVBoxLayout(patterns_tab)
+        patterns_period = QtWidgets.QHBoxLayout()
+        patterns_period.addWidget(QtWidgets.QLabel("Период:"))
+        self.patterns_period = QtWidgets.QComboBox()
+        for title, days in (("30 дней", 30), ("90 дней", 90), ("Год", 365)):
+            self.patterns_period.addItem(title, days)
+        self.patterns_period.setCurrentIndex(2)
+        patterns_period.addWidget(self.patterns_period)
+        patterns_period.addStretch(1)
+        patterns_layout.addLayout(patterns_period)
+        self.patterns_summary = QtWidgets.QLabel("")
+        self.patterns_summary.setWordWrap(True)
+        patterns_layout.addWidget(self.patterns_summary)
+        # Тепловая карта: строки — дни недели, столбцы — часы
+        self.heatmap_table = QtWidgets.QTableWidget(7, 24)
+        self.heatmap_table.setVerticalHeaderLabels(["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"])
+        self.heatmap_table.setHorizontalHeaderLabels([str(hour) for hour in range(24)])
+        self.heatmap_table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.heatmap_table.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.heatmap_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.heatmap_table.setMinimumHeight(180)
+        patterns_layout.addWidget(self.heatmap_table)
+        self.patterns_table = QtWidgets.QTableWidget(0, 5)
+        self.patterns_table.setHorizontalHeaderLabels(["Игра", "Всего", "Доля", "Сессия (медиана)", "Самая длинная"])
+        self.patterns_table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.patterns_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        patterns_layout.addWidget(self.patterns_table)
+        self.stats_tabs.addTab(patterns_tab, "Закономерности")
+
+        # Аналитика считается только при открытии подвкладки и смене периода, а не каждую секунду
+        self.stats_tabs.currentChanged.connect(lambda index: self.update_play_patterns())
+        self.tabs.currentChanged.connect(lambda index: self.update_play_patterns())
+        self.patterns_period.currentIndexChanged.connect(lambda index: self.update_play_patterns())
+        self.tabs.addTab(self.stats_tabs, "Статистика игр")
 
         # --- Вкладка Достижения ---
         ach_tab = QtWidgets.QScrollArea()
@@ -215,33 +250,72 @@ class GUIManager(QtWidgets.QWidget):
         except Exception as e:
             self.logger.error(f"Не удалось открыть окно достижений: {e}")
 
-    def update_per_game_stats(self, process_manager, period='today'):
+    def update_per_game_stats(self, process_manager, period='today', stats=None):
         if not process_manager:
             return
         try:
-            today = datetime.now().date()
-            daily = process_manager.get_usage_by_process(today)
-            start_week = today - timedelta(days=6)
-            weekly = process_manager.get_usage_by_process_range(start_week, today + timedelta(days=1))
-            meta = process_manager.get_last_seen_and_sessions(start_week, today + timedelta(days=1))
-
-            names = sorted(set(list(daily.keys()) + list(weekly.keys())))
-            self.games_table.setRowCount(len(names))
-            for row, name in enumerate(names):
-                t_day = daily.get(name, 0)
-                t_week = weekly.get(name, 0)
-                info = meta.get(name, {})
-                last_seen = info.get('last_seen', '-')
-                sessions = info.get('sessions', 0)
-                def fmt(sec):
-                    return f"{sec//3600:02d}:{(sec%3600)//60:02d}:{sec%60:02d}"
-                self.games_table.setItem(row, 0, QtWidgets.QTableWidgetItem(name))
-                self.games_table.setItem(row, 1, QtWidgets.QTableWidgetItem(fmt(t_day)))
-                self.games_table.setItem(row, 2, QtWidgets.QTableWidgetItem(fmt(t_week)))
-                self.games_table.setItem(row, 3, QtWidgets.QTableWidgetItem(f"{sessions} / {last_seen}"))
+            # Один вызов вместо отдельных запросов за день, неделю и сессии
+            if stats is None:
+                stats = process_manager.get_dashboard_stats()
+
+            def fmt(sec):
+                return f"{sec//3600:02d}:{(sec%3600)//60:02d}:{sec%60:02d}"
+            self.games_table.setRowCount(len(stats.games))
+            for row, game in enumerate(stats.games):
+                self.games_table.setItem(row, 0, QtWidgets.QTableWidgetItem(game.name))
+                self.games_table.setItem(row, 1, QtWidgets.QTableWidgetItem(fmt(game.today)))
+                self.games_table.setItem(row, 2, QtWidgets.QTableWidgetItem(fmt(game.week)))
+                self.games_table.setItem(row, 3, QtWidgets.QTableWidgetItem(f"{game.sessions} / {game.last_seen or '-'}"))
         except Exception as e:
             self.logger.error(f"Ошибка обновления пер-игровой статистики: {e}")
 
+    def update_play_patterns(self):
+        """Перерисовывает подвкладку «Закономерности», если она сейчас на экране."""
+        if not self.process_manager or self.tabs.currentWidget() is not self.stats_tabs \
+                or self.stats_tabs.currentIndex() != 1:
+            return
+        try:
+            days = self.patterns_period.currentData()
+            end = datetime.now().date() + timedelta(days=1)
+            patterns = self.process_manager.get_play_patterns(end - timedelta(days=days), end)
+            if patterns is None:
+                self.patterns_summary.setText("Для аналитики установите пакет numpy (pip install numpy).")
+                self.heatmap_table.clearContents()
+                self.patterns_table.setRowCount(0)
+                return
+
+            def fmt(sec):
+                sec = int(sec)
+                return f"{sec//3600:d}ч {(sec%3600)//60:02d}м"
+            rolling7 = patterns.rolling7[-1] if len(patterns.rolling7) else 0
+            rolling28 = patterns.rolling28[-1] if len(patterns.rolling28) else 0
+            self.patterns_summary.setText(
+                f"В среднем за день: {fmt(rolling7)} (последние 7 дней), {fmt(rolling28)} (28 дней). "
+                f"Всего за период: {fmt(patterns.totals.sum())}.")
+
+            peak = patterns.heatmap.max()
+            for weekday in range(7):
+                for hour in range(24):
+                    seconds = patterns.heatmap[weekday, hour]
+                    item = QtWidgets.QTableWidgetItem(str(int(seconds // 60)) if seconds else "")
+                    item.setToolTip(fmt(seconds))
+                    # Насыщенность цвета — доля от самого «игрового» часа
+                    level = int(255 - 200 * seconds / peak) if peak else 255
+                    item.setBackground(QtGui.QColor(255, level, level))
+                    self.heatmap_table.setItem(weekday, hour, item)
+
+            sessions = {stats.name: stats for stats in patterns.sessions}
+            self.patterns_table.setRowCount(len(patterns.games))
+            for row, name in enumerate(patterns.games):
+                stats = sessions.get(name)
+                self.patterns_table.setItem(row, 0, QtWidgets.QTableWidgetItem(name))
+                self.patterns_table.setItem(row, 1, QtWidgets.QTableWidgetItem(fmt(patterns.totals[row])))
+                self.patterns_table.setItem(row, 2, QtWidgets.QTableWidgetItem(f"{patterns.share[row] * 100:.1f}%"))
+                self.patterns_table.setItem(row, 3, QtWidgets.QTableWidgetItem(fmt(stats.median) if stats else "-"))
+                self.patterns_table.setItem(row, 4, QtWidgets.QTableWidgetItem(fmt(stats.longest) if stats else "-"))
+        except Exception as e:
+            self.logger.error(f"Ошибка обновления аналитики: {e}")
+
     def refresh_achievements(self, achievement_manager):
         try:
             # Очистить предыдущие карточки (кроме stretch)
@@ -270,7 +344,8 @@ class GUIManager(QtWidgets.QWidget):
         try:
             self.apps_list.clear()
             monitored_apps = self.process_manager.get_monitored_processes()
-            active_apps = self.process_manager.get_active_processes()
+            # Снимок последнего цикла периодических задач — без отдельного сканирования
+            active_apps = self.process_manager.current_tick().names
             for app_name in monitored_apps:
                 status = "запущен" if app_name.lower() in active_apps else "не запущен"
                 item_text = f"{app_name} — {status}"
@@ -294,6 +369,12 @@ class GUIManager(QtWidgets.QWidget):
 
 class GameTimerApp(QtWidgets.QMainWindow):
     """Основной класс приложения."""
+
+    # Настройки, которые нужны в каждом цикле периодических задач: разбираются один раз
+    # и пересчитываются по подписке на изменения (см. _apply_loop_settings)
+    LOOP_SETTINGS = ('block_until_next_day_on_limit', 'auto_start_on_game_detect', 'auto_prompt_initial_delay_sec',
+                     'process_scan_fast_before_expiry_sec', 'pre_expiry_toast_seconds',
+                     'periodic_tasks_interval_ms', 'passive_logging_interval_ms')
     def __init__(self, app):
         super().__init__()
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -302,6 +383,8 @@ class GameTimerApp(QtWidgets.QMainWindow):
         self.app = app
         self.settings = SettingsManager()
         self.process_manager = ProcessManager(self.settings)
+        # Сканирование процессов — в фоновом потоке, UI читает готовые снимки
+        self.process_manager.start_background_scanning()
         self.sound_manager = SoundManager(self.settings)
         self.gui_manager = GUIManager(self)
         self.setCentralWidget(self.gui_manager)
@@ -313,6 +396,8 @@ class GameTimerApp(QtWidgets.QMainWindow):
         self.activity_monitor = ActivityMonitor(self.settings)
         self.achievement_manager = AchievementManager(self.settings, notification_callback=self.tray_manager.show_message)
         self.daily_limit_seconds = self.settings.get('daily_limit_hours', 2) * 3600
+        self._apply_loop_settings()
+        self.settings.subscribe(self.LOOP_SETTINGS, self._apply_loop_settings)
         self.timestamp = time.time()
         # Оверлей обратного отсчета (не мешает кликам)
         self.countdown_overlay = CountdownOverlay()
@@ -360,6 +445,30 @@ class GameTimerApp(QtWidgets.QMainWindow):
         self._auto_prompt_box = None
         self._auto_prompt_open = False
 
+    def _int_setting(self, key, default, empty=None):
+        """Целое значение настройки: отсутствующее — default, пустое (0, '') — empty (по умолчанию тоже default),
+        некорректное — default.
+        """
+        try:
+            return int(self.settings.get(key, default) or (default if empty is None else empty))
+        except (TypeError, ValueError):
+            self.logger.warning(f"Некорректное значение настройки {key}, используется {default}")
+            return default
+
+    def _apply_loop_settings(self, key=None, value=None):
+        """Пересчитывает значения LOOP_SETTINGS (при запуске и при изменении любой из них через settings.set)."""
+        self._limit_until_next_day = bool(self.settings.get('block_until_next_day_on_limit', True))
+        self._auto_start_on_detect = bool(self.settings.get('auto_start_on_game_detect', True))
+        self._auto_prompt_delay_sec = self._int_setting('auto_prompt_initial_delay_sec', 20)
+        self._fast_scan_before_expiry_sec = self._int_setting('process_scan_fast_before_expiry_sec', 60, empty=0)
+        self._pre_expiry_toast_sec = self._int_setting('pre_expiry_toast_seconds', 300)
+        self._passive_interval_sec = max(60, self._int_setting('passive_logging_interval_ms', 600000, empty=0) // 1000)
+        # Таймеры создаются позже первого вызова; при изменении интервала перезапускаются с новым
+        if key == 'periodic_tasks_interval_ms' and hasattr(self, 'periodic_timer'):
+            self.periodic_timer.start(self._int_setting('periodic_tasks_interval_ms', 1000))
+        if key == 'passive_logging_interval_ms' and hasattr(self, 'passive_logging_timer'):
+            self.passive_logging_timer.start(self._int_setting('passive_logging_interval_ms', 60000))
+
     def setup_connections(self):
         self._init_hotkeys()
         # Хоткей для полного сброса данных (только для тестирования)
@@ -372,6 +481,14 @@ class GameTimerApp(QtWidgets.QMainWindow):
             self.logger.error(f"Не удалось зарегистрировать хоткей сброса: {e}")
 
     def run_periodic_tasks(self):
+        # Один снимок процессов на весь цикл: все шаги ниже читают его, а не сканируют заново
+        tick = self.process_manager.begin_tick()
+        try:
+            self._run_periodic_steps(tick)
+        finally:
+            self.process_manager.end_tick(tick)
+
+    def _run_periodic_steps(self, tick):
         # 1) Проверка активности
         self.check_activity()
         # 2) Обслуживание перерыва
@@ -379,8 +496,9 @@ class GameTimerApp(QtWidgets.QMainWindow):
         in_rest = self.is_in_rest()
         # 3) Проверка дневного лимита -> если превышен, устанавливаем перерыв до следующего дня
         try:
-            if self.settings.get('block_until_next_day_on_limit', True):
-                today_used = self.process_manager.get_daily_usage()
+            if self._limit_until_next_day:
+                # Одновременно запущенные игры не расходуют лимит дважды
+                today_used = self.process_manager.get_daily_play_seconds()
                 if today_used >= int(self.daily_limit_seconds or 0):
                     # До полуночи
                     now = datetime.now()
@@ -400,7 +518,7 @@ class GameTimerApp(QtWidgets.QMainWindow):
             self.logger.error(f"Ошибка проверки дневного лимита: {e}")
         # 4) Если во время перерыва запущены игры — немедленная блокировка + уведомление
         try:
-            if in_rest and self.process_manager.is_any_monitored_process_running():
+            if in_rest and tick.any_monitored_running:
                 self._notify_rest()
                 # Ачивки: попытка запуска во время перерыва
                 try:
@@ -422,13 +540,13 @@ class GameTimerApp(QtWidgets.QMainWindow):
             pass
         # 5) При обнаружении игры — предложить запустить таймер (если не идёт и нет перерыва)
         try:
-            if self.settings.get('auto_start_on_game_detect', True):
-                any_game = self.process_manager.is_any_monitored_process_running()
+            if self._auto_start_on_detect:
+                any_game = tick.any_monitored_running
                 timer_running = self.timer_manager.is_running()
                 if not in_rest and any_game and not timer_running:
                     # Запланировать отложенный показ, если ещё не запланирован
                     if not self._auto_prompt_pending:
-                        delay_sec = int(self.settings.get('auto_prompt_initial_delay_sec', 20) or 20)
+                        delay_sec = self._auto_prompt_delay_sec
                         self._auto_prompt_pending = True
                         QtCore.QTimer.singleShot(max(0, delay_sec) * 1000, self._auto_prompt_after_delay)
                 else:
@@ -439,10 +557,29 @@ class GameTimerApp(QtWidgets.QMainWindow):
             pass
 
         # 6) Обычный мониторинг авто-таймера и достижения
-        self._autocountup_monitor()
+        self._autocountup_monitor(tick)
         self.check_achievements()
         # 7) Обновление плашки обратного отсчета до конца
         self._update_pre_expiry_toast()
+        # 8) Подсказать сканеру процессов, насколько срочно нужны свежие данные
+        self._update_scan_demand(in_rest)
+
+    def _update_scan_demand(self, in_rest):
+        """Сообщает ProcessManager о состояниях, при которых нельзя сканировать в режиме простоя."""
+        try:
+            timer_running = self.timer_manager.is_running()
+            pending = (in_rest or timer_running or self.timer_manager.is_expired()
+                       or self._auto_prompt_pending or self._auto_prompt_open)
+            self.process_manager.set_scan_demand('app_state', 'normal' if pending else None)
+            near_expiry = False
+            if timer_running and self.timer_manager.get_mode() == 'countdown':
+                remaining = int(getattr(self.timer_manager, 'remaining_time', 0) or 0)
+                threshold = self._fast_scan_before_expiry_sec
+                near_expiry = 0 < remaining <= threshold
+            self.process_manager.set_scan_demand('countdown_expiry', 'fast' if near_expiry else None)
+        except Exception:
+            # Не мешаем основному циклу
+            pass
 
     def start_timer(self):
         try:
@@ -480,7 +617,7 @@ class GameTimerApp(QtWidgets.QMainWindow):
             if self.is_in_rest():
                 self._auto_prompt_retries = 0
                 return
-            if not self.settings.get('auto_start_on_game_detect', True):
+            if not self._auto_start_on_detect:
                 self._auto_prompt_retries = 0
                 return
             # Дебаунс: если игра "мигнула" и пропала < 2 сек, повторы не сбрасываем
@@ -706,7 +843,7 @@ class GameTimerApp(QtWidgets.QMainWindow):
             if remaining <= 0 or self.timer_manager.is_expired():
                 self.pre_expiry_toast.hide_toast()
                 return
-            threshold = int(self.settings.get('pre_expiry_toast_seconds', 300) or 300)
+            threshold = self._pre_expiry_toast_sec
             if remaining <= threshold:
                 text = f"Скоро закончится время: {self._format_mmss(remaining)}"
                 self.pre_expiry_toast.show_text(text)
@@ -766,11 +903,9 @@ class GameTimerApp(QtWidgets.QMainWindow):
 
             # 3) Удалить БД статистики использования
             try:
-                db_path = getattr(self.process_manager, '_usage_db', 'usage_stats.db')
-                if db_path and os.path.exists(db_path):
-                    os.remove(db_path)
-                # Переинициализировать БД
-                self.process_manager._init_db()
+                # Дождаться записи очереди, затем закрыть соединения, удалить файлы БД (включая WAL) и создать пустую БД
+                self.process_manager.flush(timeout=5.0)
+                self.process_manager.reset_database()
             except Exception as e:
                 self.logger.error(f"Ошибка удаления БД статистики: {e}")
 
@@ -833,9 +968,9 @@ class GameTimerApp(QtWidgets.QMainWindow):
         except Exception as e:
             self.logger.error(f"Ошибка при запуске таймера из UI: {e}")
 
-    def _autocountup_monitor(self):
+    def _autocountup_monitor(self, tick=None):
         """Мониторинг процессов для авто-таймера"""
-        any_game_running = self.process_manager.is_any_monitored_process_running()
+        any_game_running = self.process_manager.is_any_monitored_process_running(tick)
         timer_running = self.timer_manager.is_running()
         is_countup = self.timer_manager.get_mode() == 'countup'
         
@@ -1020,15 +1155,11 @@ class GameTimerApp(QtWidgets.QMainWindow):
         try:
             if getattr(self, 'manual_start', False):
                 return
-            # Проверяем, запущены ли отслеживаемые процессы
-            active = set(self.process_manager.get_active_processes())
-            monitored = set((p or '').strip().lower() for p in (self.process_manager.get_monitored_processes() or []))
-            if not active or not monitored:
-                return
-            running_tracked = active & monitored
+            # Проверяем, запущены ли отслеживаемые процессы (по снимку последнего цикла)
+            running_tracked = self.process_manager.current_tick().running_tracked()
             if not running_tracked:
                 return
-            interval_sec = max(60, int(self.settings.get('passive_logging_interval_ms', 600000) / 1000))
+            interval_sec = self._passive_interval_sec
             for proc_name in running_tracked:
                 self.process_manager.log_usage(proc_name, interval_sec)
             self.logger.debug(f"Пассивно залогировано {interval_sec} сек для: {', '.join(sorted(running_tracked))}")
@@ -1056,14 +1187,14 @@ class GameTimerApp(QtWidgets.QMainWindow):
 
     def update_stats(self):
         try:
-            today = self.process_manager.get_daily_usage()
-            week = self.process_manager.get_weekly_usage()
+            stats = self.process_manager.get_dashboard_stats()
+            today, week = stats.played, stats.week
             left = max(0, self.daily_limit_seconds - today)
             self.gui_manager.stats_today.setText(f"Сегодня: {today//3600:02d}:{(today%3600)//60:02d}:{today%60:02d}")
             self.gui_manager.stats_left.setText(f"Осталось: {left//3600:02d}:{(left%3600)//60:02d}:{left%60:02d}")
             self.gui_manager.stats_week.setText(f"За неделю: {week//3600:02d}:{(week%3600)//60:02d}:{week%60:02d}")
             # Обновить пер-игровую таблицу и достижения
-            self.gui_manager.update_per_game_stats(self.process_manager, period='today')
+            self.gui_manager.update_per_game_stats(self.process_manager, period='today', stats=stats)
             self.gui_manager.refresh_achievements(self.achievement_manager)
         except Exception as e:
             self.logger.error(f"Ошибка обновления статистики: {e}")
@@ -1108,6 +1239,20 @@ class GameTimerApp(QtWidgets.QMainWindow):
 
     def quit_app(self):
         """Корректно завершает работу приложения."""
+        try:
+            self.process_manager.stop_background_scanning()
+        except Exception as e:
+            self.logger.error(f"Ошибка остановки фонового сканирования процессов: {e}")
+        try:
+            # Дождаться записи очереди статистики, затем остановить поток-писатель и закрыть соединения с БД
+            if not self.process_manager.flush(timeout=5.0):
+                self.logger.warning("Не все записи статистики успели сохраниться при выходе")
+            self.process_manager.close()
+        except Exception as e:
+            self.logger.error(f"Ошибка закрытия БД статистики: {e}")
+        # Дописать отложенные изменения настроек (перерыв, достижения)
+        if not self.settings.flush():
+            self.logger.warning("Не удалось сохранить настройки при выходе")
         self.tray_manager.tray_icon.hide()
         self.app.quit()
 
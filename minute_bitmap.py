@@ -0,0 +1,115 @@
+"""
+Файл: minute_bitmap.py
+
+Поминутные битовые карты дня для статистики Game Timer.
+Карта — целое число Python: бит i установлен, если в минуту i местных суток
+(0 — 00:00, 1439 — 23:59) игра была запущена. Общее время по всем играм —
+побитовое ИЛИ и подсчёт единиц, поэтому две одновременно открытые игры
+не считаются дважды; пересечения и перерывы тоже получаются битовыми операциями.
+В БД карта хранится как 180 байт (little-endian).
+"""
+
+from datetime import datetime
+
+MINUTES_PER_DAY = 1440
+BITMAP_BYTES = MINUTES_PER_DAY // 8
+FULL_DAY = (1 << MINUTES_PER_DAY) - 1
+
+
+def span(start_minute, end_minute):
+    """Карта с установленными минутами [start_minute, end_minute) (границы обрезаются до суток)."""
+    start_minute = max(0, start_minute)
+    end_minute = min(MINUTES_PER_DAY, end_minute)
+    if end_minute <= start_minute:
+        return 0
+    return ((1 << (end_minute - start_minute)) - 1) << start_minute
+
+
+def count(bits):
+    return bits.bit_count()
+
+
+def union(bitmaps):
+    result = 0
+    for bits in bitmaps:
+        result |= bits
+    return result
+
+
+def overlap(bitmaps):
+    """Минуты, в которые были запущены хотя бы две игры."""
+    seen = multiple = 0
+    for bits in bitmaps:
+        multiple |= seen & bits
+        seen |= bits
+    return multiple
+
+
+def runs(bits):
+    """Непрерывные отрезки установленных минут: [(первая минута, длина)]."""
+    result = []
+    position = 0
+    while bits:
+        skip = (bits & -bits).bit_length() - 1  # нули до ближайшей единицы
+        bits >>= skip
+        position += skip
+        length = (~bits & (bits + 1)).bit_length() - 1  # единицы подряд
+        result.append((position, length))
+        bits >>= length
+        position += length
+    return result
+
+
+def gaps(bits, min_minutes=1):
+    """Перерывы между игрой: отрезки пустых минут между первой и последней игровой минутой."""
+    if not bits:
+        return []
+    first = (bits & -bits).bit_length() - 1
+    last = bits.bit_length()
+    holes = ~bits & span(first, last)
+    return [(start, length) for start, length in runs(holes) if length >= min_minutes]
+
+
+def to_bytes(bits):
+    return (bits & FULL_DAY).to_bytes(BITMAP_BYTES, 'little')
+
+
+def from_bytes(data):
+    return int.from_bytes(data, 'little') if data else 0
+
+
+def _minute_at_or_after(seconds):
+    """Первая минута суток, середина которой (m * 60 + 30) не раньше seconds от полуночи."""
+    return -(-(seconds - 30) // 60)
+
+
+def marks(ts, duration):
+    """Минуты интервала [ts - duration, ts) по местным суткам: [(день YYYYMMDD, карта)].
+    Минута отмечается, если интервал покрывает её середину (:30) — то есть границы округляются
+    до ближайшей минуты. Поэтому интервал из N полных минут отмечает ровно N минут независимо
+    от выравнивания, соседние интервалы [a, b) и [b, c) не пересекаются и не оставляют пропуска,
+    а интервал короче минуты отмечает одну минуту или ни одной (в среднем — без завышения).
+    """
+    start = ts - max(0, int(duration))
+    result = []
+    cursor = ts
+    while cursor > start:
+        moment = datetime.fromtimestamp(cursor - 1)
+        midnight = int(moment.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+        low = max(start, midnight)
+        day = moment.year * 10000 + moment.month * 100 + moment.day
+        bits = span(_minute_at_or_after(low - midnight), _minute_at_or_after(cursor - midnight))
+        if bits:
+            result.append((day, bits))
+        cursor = low
+    return result
+
+
+def collect(samples):
+    """Карты по строкам (ts, day, process_name, duration): {(день, process_name): карта}."""
+    bitmaps = {}
+    for ts, _, name, duration in samples:
+        for day, bits in marks(ts, duration):
+            key = (day, name)
+            bitmaps[key] = bitmaps.get(key, 0) | bits
+    return bitmaps
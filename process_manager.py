@@ -4,116 +4,633 @@
 Модуль для мониторинга и учёта времени, проведённого в отслеживаемых процессах (играх) в приложении Game Timer.
 """
 
-import psutil
 import logging
+import os
+import re
+import sys
 from datetime import datetime, timedelta
-import sqlite3
+import threading
 import time
+from collections import namedtuple
+import minute_bitmap
+from process_scanner import ProcessScanner, ProcessSnapshot
+from process_sources import create_process_source
+from range_cache import RangeCache
+from usage_analytics import analytics_available, analyze
+from usage_export import UsageReader, detect_format, write_rows
+from usage_journal import JournalLocked, UsageJournal
+from usage_storage import create_usage_storage, day_key
+from usage_writer import UsageWriter
+
+# Как часто продлевать end_ts открытых сессий, чтобы после сбоя сессия закрылась не позже этого
+SESSION_HEARTBEAT_SECONDS = 60
+# Записи о сессиях не ждут заполнения пачки: их видно в статистике почти сразу
+SESSION_WRITE_DELAY = 2.0
+# Настройки, от которых зависят интервалы сканирования (пересчитываются по подписке на изменения)
+SCAN_SETTINGS = ('process_check_interval_ms', 'process_snapshot_max_age_ms', 'process_scan_min_interval_ms',
+                 'process_scan_max_interval_ms', 'process_scan_fast_window_sec', 'process_scan_idle_after_sec')
+
+# Итоги для панели статистики: today/week — секунды (неделя — с понедельника по date включительно),
+# played — время за день без двойного счёта одновременно запущенных игр (по минутам),
+# games — кортеж GameStats, отсортированный по имени
+DashboardStats = namedtuple('DashboardStats', ['date', 'today', 'week', 'played', 'games'])
+# Статистика игры: today — за день, week — за последние 7 дней (включая день date),
+# sessions/last_seen — за те же 7 дней (last_seen — 'YYYY-MM-DD HH:MM:SS' или None)
+GameStats = namedtuple('GameStats', ['name', 'today', 'week', 'sessions', 'last_seen'])
+# Поминутная картина дня: played — секунды, когда была запущена хоть одна игра; overlap — секунды,
+# когда были запущены две игры и больше; gaps — перерывы внутри игрового дня [(минута начала, минут)];
+# games — {process_name: минут}
+MinuteUsage = namedtuple('MinuteUsage', ['date', 'played', 'overlap', 'gaps', 'games'])
+
+
+class ProcessTick:
+    """Снимок процессов, общий для всех потребителей одного цикла периодических задач.
+    Снимок берётся лениво при первом обращении и до конца цикла не меняется,
+    поэтому за один цикл таблица процессов читается не более одного раза.
+    """
+
+    def __init__(self, manager):
+        self._manager = manager
+        self._snapshot = None
+        self._sync_scans_at_start = manager.sync_scan_count
+        self.started_at = time.time()
+        self.scans = 0  # заполняется в ProcessManager.end_tick
+
+    @property
+    def snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = self._manager.snapshot()
+        return self._snapshot
+
+    @property
+    def names(self):
+        """frozenset имён запущенных процессов (lowercase)."""
+        return self.snapshot.names
+
+    @property
+    def any_monitored_running(self):
+        if not self._manager._get_monitored_set():
+            return False
+        return bool(self.snapshot.monitored)
+
+    def running_tracked(self):
+        """Отслеживаемые процессы, запущенные в этом цикле (по точному совпадению имени)."""
+        return self.snapshot.names & self._manager._get_monitored_set()
+
 
 class ProcessManager:
-    def __init__(self, settings):
+    def __init__(self, settings, storage=None, journal=True):
         self.settings = settings
         self.logger = logging.getLogger('ProcessManager')
-        self._cache = {}
-        self._cache_time = 0
-        # Время жизни кэша берём из настроек проверки процессов (в секундах)
-        self._cache_lifetime = max(1, int(self.settings.get('process_check_interval_ms', 5000) / 1000))
-        self._usage_db = "usage_stats.db"
+        # Инкрементальный сканер: диф множества PID вместо полного обхода таблицы процессов
+        self._scanner = ProcessScanner(create_process_source(self.settings.get('process_source', 'psutil')))
+        # Снимки набора процессов: сканер принадлежит воркеру, читатели берут последний снимок
+        self._snapshot = ProcessSnapshot(0, 0.0, frozenset(), frozenset())
+        self._scan_lock = threading.Lock()
+        self._scan_stop = threading.Event()
+        self._scan_wakeup = threading.Event()
+        self._scan_thread = None
+        # Интервалы сканирования и список игр читаются из настроек один раз и пересчитываются
+        # только при их изменении, поэтому циклы сканирования работают с готовыми атрибутами
+        self._apply_scan_settings()
+        self._apply_monitored_processes()
+        self.settings.subscribe(SCAN_SETTINGS, self._apply_scan_settings)
+        self.settings.subscribe('processes', self._apply_monitored_processes)
+        self._scan_interval = self._cache_lifetime
+        self._fast_scan_until = 0.0
+        self._seen_names = set()  # имена процессов, уже встречавшиеся за время работы
+        self._last_monitored_seen = 0.0
+        self._scan_demands = {}  # причина -> 'fast' | 'normal'
+        self.scan_count = 0
+        self.sync_scan_count = 0  # проходы, выполненные не воркером (в потоке вызывающего)
+        # Циклы периодических задач: общий снимок на цикл и статистика сканирований за цикл
+        self._current_tick = None
+        self._tick_stats = {'ticks': 0, 'last_scans': 0, 'max_scans': 0, 'total_scans': 0}
+        # Хранилище статистики: SQLite-файл по пути из настроек (по умолчанию) или память;
+        # все записи идут через поток-писатель
+        self._storage = storage if storage is not None else create_usage_storage(
+            self.settings.get('usage_storage', 'sqlite'), self._usage_db_path())
         self._last_cleanup = time.time()
         self._cleanup_interval = 3600
-        self._write_buffer = []
+        # Политика хранения: удаление порциями и постепенное освобождение места в фоне
+        self._cleanup_batch_size = 2000
+        self._vacuum_pages_per_step = 256
+        self._retention_job = None
+        self.last_cleanup_report = None
         self._buffer_size = 100
-        self._last_flush = time.time()
         self._flush_interval = 300
-        self._monitored_set = None  # кэш множества целевых процессов (lowercase)
-        self._init_db()
+        self._write_queue_size = 1000
+        self._write_put_timeout = 2.0
+        self._import_batch_size = 5000
+        self._writer = self._create_writer()
+        # Журнал строк, ещё не записанных в БД: переживает падение процесса и отключение питания
+        # journal=False — без журнала; journal_in_use — журналом владеет другой процесс (запущенное приложение),
+        # usage_tool по этому признаку отказывается работать
+        self._journal_path = (os.path.splitext(self._storage.path)[0] + '.journal'
+                              if journal and self._storage.path else None)
+        self._journal = None
+        self.journal_in_use = False
+        # Результаты запросов по диапазонам дней; сбрасываются писателем по изменённым дням
+        self._range_cache = RangeCache(maxsize=256)
+        # Счётчики за текущий локальный день: засеваются из БД один раз и далее ведутся в памяти,
+        # поэтому проверка лимита и надписи статистики не обращаются к диску и учитывают ещё не записанный буфер
+        self._today = None
+        self._today_total = 0
+        self._today_by_process = {}
+        # Поминутные карты текущего дня по играм и их объединение (см. minute_bitmap)
+        self._today_minutes = {}
+        self._today_union = 0
+        self._last_logged = {}  # process_name -> (ts, duration) для замены записи в ту же секунду
+        # Открытые сессии отслеживаемых игр: name -> [start_ts, последний heartbeat];
+        # id строк в таблице sessions знает только поток-писатель
+        self._open_sessions = {}
+        self._session_ids = {}
+        self._scanner.add_listener(self._on_process_events)
+        self._journal = self._open_journal()
+        self._ensure_today()
+
+    def _apply_scan_settings(self, key=None, value=None):
+        """Пересчитывает интервалы сканирования из настроек (при создании и при изменении SCAN_SETTINGS)."""
+        # Время жизни кэша берём из настроек проверки процессов (в секундах)
+        self._cache_lifetime = max(1, int(self.settings.get('process_check_interval_ms', 5000) / 1000))
+        self._snapshot_max_age = max(1.0, self.settings.get('process_snapshot_max_age_ms', 10000) / 1000)
+        # Адаптивная частота сканирования: быстро после новых PID/у конца отсчёта, медленно в простое
+        self._scan_min_interval = max(0.1, self.settings.get('process_scan_min_interval_ms', 500) / 1000)
+        self._scan_max_interval = max(self._scan_min_interval, self.settings.get('process_scan_max_interval_ms', 20000) / 1000)
+        self._scan_fast_window = max(0.0, float(self.settings.get('process_scan_fast_window_sec', 10)))
+        self._scan_idle_after = max(0.0, float(self.settings.get('process_scan_idle_after_sec', 120)))
+        if key is not None:
+            # Воркер пересчитает паузу по новым границам, не дожидаясь конца текущей
+            self._scan_wakeup.set()
+
+    def _apply_monitored_processes(self, key=None, value=None):
+        """Пересобирает множество отслеживаемых имён (lowercase) и матчер имён/путей
+        при создании и при изменении settings['processes'].
+        """
+        procs = self.settings.get("processes", []) or []
+        try:
+            monitored = frozenset(p.strip().lower() for p in procs if p and isinstance(p, str))
+        except Exception:
+            monitored = frozenset()
+        # Длинные имена первыми, чтобы альтернативы не перекрывали друг друга
+        patterns = sorted(monitored, key=len, reverse=True)
+        matcher = re.compile('|'.join(re.escape(p) for p in patterns)) if patterns else None
+        version = self._path_matcher[0] + 1 if key is not None else 1
+        # Атрибуты заменяются целиком: поток сканирования видит либо старый, либо новый набор
+        self._monitored_set = monitored
+        self._path_matcher = (version, matcher)
+        if key is not None:
+            self._scan_wakeup.set()
+
+    def _usage_db_path(self):
+        """Путь к файлу БД из настройки usage_db_path. Относительный путь считается от каталога
+        файла настроек (если он задан абсолютно) или каталога приложения, а не от текущего каталога.
+        Прежние версии открывали его от текущего каталога: если там есть база, а по новому пути ещё нет,
+        используется она, иначе история молча начиналась бы заново.
+        """
+        path = os.path.expanduser(self.settings.get('usage_db_path', 'usage_stats.db') or 'usage_stats.db')
+        if not os.path.isabs(path):
+            legacy_path = os.path.abspath(path)
+            settings_file = getattr(self.settings, 'filename', None)
+            if settings_file and os.path.isabs(settings_file):
+                base = os.path.dirname(settings_file)
+            elif getattr(sys, 'frozen', False):
+                base = os.path.dirname(sys.executable)
+            else:
+                base = os.path.dirname(os.path.abspath(__file__))
+            path = os.path.join(base, path)
+            if not os.path.exists(path) and os.path.exists(legacy_path) and legacy_path != os.path.abspath(path):
+                self.logger.warning(f"Usage database not found at {path}, using existing {legacy_path} "
+                                    f"from the working directory; move it there or set an absolute usage_db_path")
+                return legacy_path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return path
+
+    def _create_writer(self):
+        return UsageWriter(self._write_batch, close=self._storage.close_writer, batch_size=self._buffer_size,
+                           max_delay=self._flush_interval, queue_size=self._write_queue_size,
+                           put_timeout=self._write_put_timeout)
 
-    def _init_db(self):
-        """Инициализация базы данных для статистики"""
+    def _open_journal(self):
+        """Открывает журнал и проигрывает в хранилище записи, не дошедшие до него при прошлом запуске."""
+        if not self._journal_path:
+            return None
         try:
-            with sqlite3.connect(self._usage_db) as conn:
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS usage_stats (
-                        timestamp TEXT,
-                        process_name TEXT,
-                        duration INTEGER,
-                        PRIMARY KEY (timestamp, process_name)
-                    )
-                ''')
-                conn.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_process_time 
-                    ON usage_stats(process_name, timestamp)
-                ''')
-            self.logger.info("Database initialized successfully")
-        except sqlite3.Error as e:
-            self.logger.error(f"Database initialization error: {e}")
-            raise
+            journal = UsageJournal(self._journal_path)
+        except JournalLocked:
+            # Журналом владеет другой процесс (запущенное приложение): его записи не проигрываем
+            self.journal_in_use = True
+            self.logger.warning(f"Usage journal {self._journal_path} is in use by another process, running without it")
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Usage journal unavailable, unsaved records will not survive a crash: {e}")
+            return None
+        rows = journal.replay()
+        if rows:
+            try:
+                # Повтор уже записанной строки заменяет её — в агрегаты попадает нулевая разница
+                self._storage.write(rows, [], {})
+                self.logger.info(f"Replayed {len(rows)} journaled usage records")
+            except Exception as e:
+                self.logger.error(f"Error replaying usage journal: {e}")
+                return journal
+        journal.reset()
+        return journal
+
+    def rebuild_rollups(self):
+        """Полностью пересобирает дневные агрегаты из сырых данных. Возвращает число строк агрегатов.
+        Выполняется в потоке-писателе после всех уже поставленных в очередь записей.
+        """
+        started = time.time()
+        rows = self._writer.call(self._storage.rebuild_rollups)
+        self._range_cache.clear()
+        self.logger.info(f"Rebuilt {rows} daily rollup rows in {time.time() - started:.2f}s")
+        return rows
+
+    def _write_batch(self, batch):
+        """Записывает пачку из очереди писателя одной транзакцией хранилища (поток-писатель),
+        затем сбрасывает кэш по затронутым дням и обнуляет журнал.
+        """
+        samples = [payload for kind, payload in batch if kind == 'usage']
+        session_ops = [(kind, payload) for kind, payload in batch if kind.startswith('session_')]
+        self._session_ids = self._storage.write([row for row, _ in samples], session_ops, self._session_ids)
+        usage_days = {row[1] for row, _ in samples}
+        session_days = set()
+        for _, (_, ts) in session_ops:
+            # Продление/склейка сессии меняет end_ts не более чем на пару интервалов heartbeat назад
+            session_days.add(day_key(datetime.fromtimestamp(ts)))
+            session_days.add(day_key(datetime.fromtimestamp(ts - 2 * SESSION_HEARTBEAT_SECONDS)))
+        # Интервал записи, начатый до полуночи, отмечает минуты и в поминутной карте предыдущего дня
+        minute_days = {day_key(datetime.fromtimestamp(row[0] - row[3])) for row, _ in samples} - usage_days
+        self._range_cache.invalidate_days(usage_days, exclude_kinds=('sessions',))
+        self._range_cache.invalidate_days(session_days, kinds=('sessions',))
+        self._range_cache.invalidate_days(minute_days, kinds=('day_minutes',))
+        journal_seq = max((seq for _, seq in samples if seq is not None), default=None)
+        if journal_seq is not None and self._journal is not None:
+            self._journal.committed(journal_seq)
+
+    def flush(self, timeout=5.0):
+        """Ждёт, пока поток-писатель зафиксирует всё, что уже поставлено в очередь.
+        Возвращает False, если не успел за timeout секунд.
+        """
+        flushed = self._writer.flush(timeout)
+        if not flushed:
+            self.logger.warning(f"Usage writer did not flush within {timeout}s ({self._writer.pending()} pending)")
+        return flushed
+
+    def close(self, timeout=5.0):
+        """Записывает очередь, останавливает поток-писатель и закрывает хранилище
+        (вызывается при выходе из приложения).
+        """
+        self.settings.unsubscribe(self._apply_scan_settings)
+        self.settings.unsubscribe(self._apply_monitored_processes)
+        if not self._writer.stop(timeout):
+            self.logger.warning("Usage writer did not stop in time")
+        elif self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._storage.close()
+        self.logger.info("Database connection closed")
+
+    def reset_database(self):
+        """Удаляет все данные статистики (файл БД вместе с WAL/SHM) и начинает с пустого хранилища."""
+        # Замена писателя — под блокировкой сканирования: поток сканирования ставит в очередь
+        # записи сессий и не должен застать остановленного писателя
+        with self._scan_lock:
+            # Писатель дописывает очередь и освобождает своё соединение — файл можно удалять
+            self._writer.stop()
+            self._writer = self._create_writer()
+            # Шаг незавершённого прохода очистки остался в очереди старого писателя
+            self._retention_job = None
+            self._open_sessions.clear()
+            self._session_ids = {}
+            self._range_cache.clear()
+            if self._journal is not None:
+                self._journal.reset()
+            self._storage.reset()
+        self._today = None
+        self._ensure_today()
 
     def get_monitored_processes(self):
         """Возвращает список отслеживаемых процессов из настроек"""
         return self.settings.get("processes", [])
 
     def _get_monitored_set(self):
-        """Возвращает множество имён процессов в lowercase для быстрого сравнения."""
-        procs = self.settings.get("processes", []) or []
-        try:
-            return set(p.strip().lower() for p in procs if p and isinstance(p, str))
-        except Exception:
-            return set()
+        """Возвращает множество имён процессов в lowercase для быстрого сравнения (готовое, см. _apply_monitored_processes)."""
+        return self._monitored_set
 
-    def get_active_processes(self):
-        """Получение списка активных процессов с кэшированием"""
-        current_time = time.time()
-        if current_time - self._cache_time <= self._cache_lifetime:
-            return list(self._cache.keys())
-        try:
-            new_cache = {}
-            for proc in psutil.process_iter(['name']):
-                try:
-                    proc_name = proc.info['name']
-                    if proc_name:
-                        new_cache[proc_name.lower()] = {
-                            'pid': proc.pid,
-                            'last_update': current_time
-                        }
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    continue
-            self._cache = new_cache
-            self._cache_time = current_time
+    def add_process_to_monitor(self, process_name):
+        """Добавляет процесс в список отслеживаемых (без учёта регистра); возвращает True, если список изменился."""
+        name = (process_name or "").strip()
+        if not name or name.lower() in self._monitored_set:
+            return False
+        self.settings.set("processes", list(self.get_monitored_processes()) + [name])
+        self.logger.info(f"Process added to monitoring: {name}")
+        return True
+
+    def remove_process_from_monitor(self, process_name):
+        """Удаляет процесс из списка отслеживаемых (без учёта регистра); возвращает True, если список изменился."""
+        name = (process_name or "").strip().lower()
+        procs = list(self.get_monitored_processes())
+        remaining = [p for p in procs if not (isinstance(p, str) and p.strip().lower() == name)]
+        if len(remaining) == len(procs):
+            return False
+        self.settings.set("processes", remaining)
+        self.logger.info(f"Process removed from monitoring: {process_name}")
+        return True
+
+    def start_background_scanning(self):
+        """Запускает фоновый поток, который владеет сканированием и публикует снимки процессов."""
+        if self._scan_thread is not None and self._scan_thread.is_alive():
+            return
+        self._scan_stop.clear()
+        self._scan_thread = threading.Thread(target=self._scan_loop, name='ProcessScanWorker', daemon=True)
+        self._scan_thread.start()
+        self.logger.info("Background process scanning started")
+
+    def stop_background_scanning(self, timeout=2.0):
+        """Останавливает фоновый поток сканирования."""
+        thread = self._scan_thread
+        if thread is None:
+            return
+        self._scan_stop.set()
+        self._scan_wakeup.set()
+        thread.join(timeout)
+        self._scan_thread = None
+        self.logger.info("Background process scanning stopped")
+
+    def _scan_loop(self):
+        while not self._scan_stop.is_set():
+            try:
+                self._refresh_snapshot()
+            except Exception as e:
+                self.logger.error(f"Error in background process scan: {e}")
+            self._scan_interval = self._next_scan_interval(time.time())
+            # Ожидание прерывается, если кто-то запросил более частое сканирование
+            self._scan_wakeup.wait(self._scan_interval)
+            self._scan_wakeup.clear()
+
+    def _next_scan_interval(self, now):
+        """Выбирает паузу до следующего прохода:
+        - минимальная (process_scan_min_interval_ms) — короткое окно после появления новых PID
+          или пока есть запрос 'fast' (например, отсчёт близок к концу);
+        - обычная (process_check_interval_ms) — игра была недавно или есть запрос 'normal';
+        - максимальная (process_scan_max_interval_ms) — в простое.
+        """
+        demands = self._scan_demands.values()
+        if now < self._fast_scan_until or 'fast' in demands:
+            return self._scan_min_interval
+        normal = min(max(self._cache_lifetime, self._scan_min_interval), self._scan_max_interval)
+        if demands or (now - self._last_monitored_seen) < self._scan_idle_after:
+            return normal
+        return self._scan_max_interval
+
+    def set_scan_demand(self, reason, level):
+        """Сообщает сканеру о состоянии приложения, требующем более частых проверок.
+        level: 'fast' — минимальный интервал, 'normal' — обычный, None — снять запрос.
+        """
+        previous = self._scan_demands.get(reason)
+        if level == previous:
+            return
+        if level:
+            self._scan_demands[reason] = level
+        else:
+            self._scan_demands.pop(reason, None)
+        # Если требуемая частота выросла — будим воркер, чтобы он пересчитал паузу
+        if level and self._next_scan_interval(time.time()) < self._scan_interval:
+            self._scan_wakeup.set()
+
+    def _refresh_snapshot(self, stale_before=None):
+        """Выполняет проход сканера и публикует новый снимок.
+        Если задан stale_before и пока ждали блокировку был опубликован более свежий снимок — возвращает его.
+        """
+        with self._scan_lock:
+            current = self._snapshot
+            if stale_before is not None and current.taken_at >= stale_before:
+                return current
+            monitored_set = self._get_monitored_set()
+            events = self._scanner.scan(monitored_set)
+            names = frozenset(self._scanner.names())
+            monitored = names & monitored_set
+            if monitored_set and not monitored:
+                # Редкий случай: совпадение только по пути к exe
+                monitored = self._monitored_by_path()
+            current_time = time.time()
+            started = {e.name for e in events if e.kind == 'started'}
+            if current.version and (started - self._seen_names or started & monitored_set):
+                # Незнакомый процесс может оказаться лаунчером игры — следующие проходы делаем чаще.
+                # Повторные запуски уже виденных имён (svchost, conhost, процессы браузера) окно не открывают
+                self._fast_scan_until = current_time + self._scan_fast_window
+            self._seen_names |= started
+            if monitored:
+                self._last_monitored_seen = current_time
+            self._heartbeat_sessions(names & monitored_set, current_time)
+            snapshot = ProcessSnapshot(current.version + 1, current_time, names, monitored)
+            self._snapshot = snapshot
+            self.scan_count += 1
+            if threading.current_thread() is not self._scan_thread:
+                self.sync_scan_count += 1
             if current_time - self._last_cleanup >= self._cleanup_interval:
-                self.cleanup_old_data()
+                # Очистка выполняется потоком-писателем в паузах между записями, сканирование её не ждёт
+                self._schedule_retention()
                 self._last_cleanup = current_time
-            return list(self._cache.keys())
+            return snapshot
+
+    def snapshot(self):
+        """Возвращает последний опубликованный снимок процессов (O(1)).
+        Если снимок старше допустимого (воркер не запущен или завис) — сканирует синхронно.
+        """
+        snapshot = self._snapshot
+        current_time = time.time()
+        worker_alive = self._scan_thread is not None and self._scan_thread.is_alive()
+        # При редком сканировании в простое снимок законно старше обычного предела
+        max_age = max(self._snapshot_max_age, 2 * self._scan_interval) if worker_alive else self._cache_lifetime
+        if current_time - snapshot.taken_at <= max_age:
+            return snapshot
+        try:
+            return self._refresh_snapshot(stale_before=current_time - max_age)
         except Exception as e:
             self.logger.error(f"Error getting active processes: {e}")
-            return list(self._cache.keys()) if self._cache else []
+            return self._snapshot
+
+    def begin_tick(self):
+        """Начинает цикл периодических задач: возвращает ProcessTick, который передаётся всем потребителям."""
+        tick = ProcessTick(self)
+        self._current_tick = tick
+        return tick
+
+    def end_tick(self, tick):
+        """Завершает цикл: фиксирует, сколько синхронных сканирований было выполнено за время цикла."""
+        tick.scans = self.sync_scan_count - tick._sync_scans_at_start
+        stats = self._tick_stats
+        stats['ticks'] += 1
+        stats['last_scans'] = tick.scans
+        stats['max_scans'] = max(stats['max_scans'], tick.scans)
+        stats['total_scans'] += tick.scans
+        if tick.scans > 1:
+            self.logger.warning(f"Periodic tick performed {tick.scans} process scans (expected at most 1)")
+
+    def current_tick(self):
+        """Возвращает ProcessTick последнего цикла (или новый, если циклов ещё не было)."""
+        return self._current_tick or self.begin_tick()
+
+    def tick_stats(self):
+        """Статистика сканирований на цикл: ticks, last_scans, max_scans, total_scans."""
+        return dict(self._tick_stats)
+
+    def get_active_processes(self):
+        """Получение списка активных процессов из последнего снимка"""
+        return list(self.snapshot().names)
+
+    def add_process_listener(self, callback):
+        """Подписка на события запуска/остановки процессов: callback(events: list[ProcessEvent])."""
+        self._scanner.add_listener(callback)
+
+    def remove_process_listener(self, callback):
+        self._scanner.remove_listener(callback)
 
     def log_usage(self, process_name, duration):
-        """Логирование использования процесса с буферизацией"""
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self._write_buffer.append((timestamp, process_name, int(duration)))
-        self._flush_buffer()
+        """Логирование использования процесса: запись дописывается в журнал (mmap, без транзакции)
+        и уходит в очередь потока-писателя, счётчики текущего дня обновляются сразу.
+        """
+        now = datetime.now()
+        ts, day, duration = int(now.timestamp()), day_key(now), int(duration)
+        self._ensure_today(now)
+        self._count_today(ts, day, process_name, duration)
+        seq = None
+        if self._journal is not None:
+            try:
+                seq = self._journal.append(ts, day, process_name, duration)
+            except (OSError, ValueError) as e:
+                self.logger.error(f"Error appending to usage journal: {e}")
+        self._writer.submit('usage', ((ts, day, process_name, duration), seq))
+
+    def _ensure_today(self, now=None):
+        """Возвращает ключ текущего дня; на границе суток заново засевает счётчики из БД.
+        Строки нового дня ещё не могут ждать в очереди: log_usage засевает счётчики до постановки записи.
+        """
+        today = day_key(now or datetime.now())
+        if today == self._today:
+            return today
+        total = 0
+        by_process = {}
+        minutes = {}
+        try:
+            for name, seconds in self._storage.day_by_process(today):
+                by_process[name] = int(seconds or 0)
+                total += int(seconds or 0)
+            minutes = self._storage.day_minutes(today)
+        except Exception as e:
+            self.logger.error(f"Error seeding today's usage counters: {e}")
+        self._today = today
+        self._today_total = total
+        self._today_by_process = by_process
+        self._today_minutes = minutes
+        self._today_union = minute_bitmap.union(minutes.values())
+        self._last_logged = {}
+        return today
+
+    def _count_today(self, ts, day, process_name, duration):
+        if day != self._today:
+            return
+        # Повторная запись (ts, process_name) заменяет предыдущую — как INSERT OR REPLACE в БД
+        last = self._last_logged.get(process_name)
+        if last is not None and last[0] == ts:
+            duration -= last[1]
+            self._last_logged[process_name] = (ts, last[1] + duration)
+        else:
+            self._last_logged[process_name] = (ts, duration)
+        self._today_total += duration
+        self._today_by_process[process_name] = self._today_by_process.get(process_name, 0) + duration
+        for mark_day, bits in minute_bitmap.marks(ts, duration):
+            if mark_day == day:
+                self._today_minutes[process_name] = self._today_minutes.get(process_name, 0) | bits
+                self._today_union |= bits
+
+    def _range_total(self, start_date, end_date):
+        """Сумма за [start_date, end_date): прошлые дни — из usage_daily, сегодня — из счётчиков в памяти."""
+        today = self._ensure_today()
+        start, end = day_key(start_date), day_key(end_date)
+        total = self._cached('range_total', start, end, today, lambda: self._storage.range_total(start, end, today))
+        if start <= today < end:
+            total += self._today_total
+        return total
+
+    def _cached(self, kind, start, end, excluded, compute):
+        """Результат запроса по диапазону дней [start, end) (ключи YYYYMMDD) — из кэша или compute().
+        excluded — день, не входящий в результат (сегодня берётся из памяти); его запись кэш не сбрасывает.
+        """
+        key = (kind, start, end, excluded)
+        hit, value = self._range_cache.get(key)
+        if hit:
+            return value
+        generation = self._range_cache.generation
+        value = compute()
+        self._range_cache.put(key, value, generation)
+        return value
+
+    def cache_stats(self):
+        """Счётчики кэша запросов по диапазонам: hits, misses, hit_rate, size, invalidations."""
+        return self._range_cache.stats()
 
     def get_daily_usage(self, date=None):
-        """Возвращает суммарное время использования всех отслеживаемых процессов за день (секунды)"""
+        """Возвращает суммарное время использования всех отслеживаемых процессов за день (секунды).
+        Для сегодняшнего дня — O(1) из счётчиков в памяти (включая ещё не записанную очередь).
+        """
         if date is None:
-            date = datetime.now().date()
-        else:
-            date = datetime.strptime(date, '%Y-%m-%d').date() if isinstance(date, str) else date
+            self._ensure_today()
+            return self._today_total
+        date = datetime.strptime(date, '%Y-%m-%d').date() if isinstance(date, str) else date
+        if day_key(date) == self._ensure_today():
+            return self._today_total
         total = 0
         try:
-            with sqlite3.connect(self._usage_db) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT SUM(duration) FROM usage_stats
-                    WHERE date(timestamp) = ?
-                ''', (date.strftime('%Y-%m-%d'),))
-                result = cursor.fetchone()
-                total = result[0] if result and result[0] else 0
+            day, next_day = day_key(date), day_key(date + timedelta(days=1))
+            total = self._cached('day_total', day, next_day, 0, lambda: self._storage.day_total(day))
         except Exception as e:
             self.logger.error(f"Error getting daily usage: {e}")
         return total
 
+    def get_daily_play_seconds(self, date=None):
+        """Время за день, когда была запущена хотя бы одна отслеживаемая игра (секунды, с точностью до минуты).
+        В отличие от get_daily_usage, две одновременно открытые игры не считаются дважды — по нему проверяется
+        дневной лимит. Для сегодняшнего дня — O(1) из поминутной карты в памяти.
+        """
+        if date is None or day_key(self._parse_date(date)) == self._ensure_today():
+            self._ensure_today()
+            return minute_bitmap.count(self._today_union) * 60
+        return minute_bitmap.count(minute_bitmap.union(self._day_minutes(self._parse_date(date)).values())) * 60
+
+    def get_minute_usage(self, date=None):
+        """Поминутная картина дня (по умолчанию сегодня): общее время, пересечения игр и перерывы (MinuteUsage)."""
+        date = datetime.now().date() if date is None else self._parse_date(date)
+        if day_key(date) == self._ensure_today():
+            bitmaps = dict(self._today_minutes)
+        else:
+            bitmaps = self._day_minutes(date)
+        played = minute_bitmap.union(bitmaps.values())
+        return MinuteUsage(
+            date=date,
+            played=minute_bitmap.count(played) * 60,
+            overlap=minute_bitmap.count(minute_bitmap.overlap(bitmaps.values())) * 60,
+            gaps=tuple(minute_bitmap.gaps(played)),
+            games={name: minute_bitmap.count(bits) for name, bits in bitmaps.items()},
+        )
+
+    def _parse_date(self, value):
+        return datetime.strptime(value, '%Y-%m-%d').date() if isinstance(value, str) else value
+
+    def _day_minutes(self, date):
+        """Поминутные карты прошлого дня {process_name: карта} (из кэша или БД)."""
+        try:
+            day, next_day = day_key(date), day_key(date + timedelta(days=1))
+            return self._cached('day_minutes', day, next_day, 0, lambda: self._storage.day_minutes(day))
+        except Exception as e:
+            self.logger.error(f"Error getting minute usage: {e}")
+            return {}
+
     def get_weekly_usage(self, start_date=None):
         """Возвращает суммарное время использования всех отслеживаемых процессов за неделю (секунды)"""
         if start_date is None:
@@ -124,40 +641,11 @@ class ProcessManager:
         end_date = start_date + timedelta(days=7)
         total = 0
         try:
-            with sqlite3.connect(self._usage_db) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT SUM(duration) FROM usage_stats
-                    WHERE date(timestamp) >= ? AND date(timestamp) < ?
-                ''', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
-                result = cursor.fetchone()
-                total = result[0] if result and result[0] else 0
+            total = self._range_total(start_date, end_date)
         except Exception as e:
             self.logger.error(f"Error getting weekly usage: {e}")
         return total
 
-    def _flush_buffer(self, force=False):
-        """Записывает буферизированные данные в БД"""
-        current_time = time.time()
-        if not force and len(self._write_buffer) < self._buffer_size and \
-           current_time - self._last_flush < self._flush_interval:
-            return
-        if not self._write_buffer:
-            return
-        try:
-            with sqlite3.connect(self._usage_db) as conn:
-                cursor = conn.cursor()
-                cursor.executemany(
-                    'INSERT OR REPLACE INTO usage_stats (timestamp, process_name, duration) VALUES (?, ?, ?)',
-                    self._write_buffer
-                )
-                conn.commit()
-            self.logger.debug(f"Flushed {len(self._write_buffer)} records to database")
-            self._write_buffer.clear()
-            self._last_flush = current_time
-        except sqlite3.Error as e:
-            self.logger.error(f"Error flushing buffer to database: {e}")
-
     # --- Aggregations for per-game details ---
     def get_usage_by_process(self, date=None):
         """Возвращает словарь {process_name: seconds} за указанный день (по умолчанию сегодня)."""
@@ -165,24 +653,22 @@ class ProcessManager:
             date = datetime.now().date()
         else:
             date = datetime.strptime(date, '%Y-%m-%d').date() if isinstance(date, str) else date
+        if day_key(date) == self._ensure_today():
+            return dict(self._today_by_process)
         result = {}
         try:
-            with sqlite3.connect(self._usage_db) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT process_name, SUM(duration) as total
-                    FROM usage_stats
-                    WHERE date(timestamp) = ?
-                    GROUP BY process_name
-                ''', (date.strftime('%Y-%m-%d'),))
-                for name, total in cursor.fetchall():
-                    result[name] = int(total or 0)
+            day, next_day = day_key(date), day_key(date + timedelta(days=1))
+            rows = self._cached('day_by_process', day, next_day, 0,
+                                lambda: tuple(self._storage.day_by_process(day)))
+            for name, total in rows:
+                result[name] = int(total or 0)
         except Exception as e:
             self.logger.error(f"Error getting usage by process: {e}")
         return result
 
     def get_usage_by_process_range(self, start_date, end_date=None):
         """Возвращает словарь {process_name: seconds} за период [start_date, end_date).
+        Читается из дневных агрегатов, которые покрывают все уровни хранения (сырые, почасовые, только дневные).
         Если end_date не указан, берется start_date + 7 дней.
         Принимает даты как date или 'YYYY-MM-DD'.
         """
@@ -194,23 +680,88 @@ class ProcessManager:
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         result = {}
         try:
-            with sqlite3.connect(self._usage_db) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT process_name, SUM(duration) as total
-                    FROM usage_stats
-                    WHERE date(timestamp) >= ? AND date(timestamp) < ?
-                    GROUP BY process_name
-                ''', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
-                for name, total in cursor.fetchall():
-                    result[name] = int(total or 0)
+            today = self._ensure_today()
+            start, end = day_key(start_date), day_key(end_date)
+            rows = self._cached('range_by_process', start, end, today,
+                                lambda: tuple(self._storage.range_by_process(start, end, today)))
+            for name, total in rows:
+                result[name] = int(total or 0)
+            if start <= today < end:
+                for name, seconds in self._today_by_process.items():
+                    result[name] = result.get(name, 0) + seconds
         except Exception as e:
             self.logger.error(f"Error getting usage by process range: {e}")
         return result
 
+    def get_hourly_usage(self, start_date, end_date=None):
+        """Возвращает {начало часа (epoch-секунды): seconds} за период [start_date, end_date)
+        по всем процессам. Недавние часы считаются по сырым записям, старые — по usage_hourly;
+        за дни старше usage_hourly_retention_days почасовой разбивки нет (только дневные итоги).
+        Записи, ещё ждущие в очереди писателя, не учитываются.
+        """
+        if isinstance(start_date, str):
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+        if end_date is None:
+            end_date = start_date + timedelta(days=1)
+        elif isinstance(end_date, str):
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        start_ts = int(datetime.combine(start_date, datetime.min.time()).timestamp())
+        end_ts = int(datetime.combine(end_date, datetime.min.time()).timestamp())
+        result = {}
+        try:
+            for hour, seconds in self._storage.hourly(start_ts, end_ts):
+                result[hour] = result.get(hour, 0) + int(seconds or 0)
+        except Exception as e:
+            self.logger.error(f"Error getting hourly usage: {e}")
+        return dict(sorted(result.items()))
+
+    # --- Sessions (intervals maintained from process start/stop events) ---
+    def _on_process_events(self, events):
+        """Открывает/закрывает сессии отслеживаемых игр по событиям сканера (поток сканирования)."""
+        monitored = self._get_monitored_set()
+        for event in events:
+            if event.name not in monitored:
+                continue
+            if event.kind == 'started':
+                self._open_session(event.name, int(event.timestamp))
+            elif event.kind == 'stopped' and not self._scanner.pids_for(event.name):
+                # Сессия игры заканчивается, когда завершился последний её процесс
+                self._close_session(event.name, int(event.timestamp))
+
+    def _open_session(self, name, ts):
+        if name in self._open_sessions:
+            return
+        self._open_sessions[name] = [ts, ts]
+        self._writer.submit('session_open', (name, ts), delay=SESSION_WRITE_DELAY)
+
+    def _close_session(self, name, ts):
+        if self._open_sessions.pop(name, None) is None:
+            return
+        self._writer.submit('session_close', (name, ts), delay=SESSION_WRITE_DELAY)
+
+    def _heartbeat_sessions(self, running, now):
+        """Продлевает открытые сессии и сверяет их с набором запущенных игр
+        (на случай изменения списка отслеживаемых процессов во время игры).
+        """
+        now = int(now)
+        for name in list(self._open_sessions):
+            if name not in running:
+                self._close_session(name, now)
+        for name in running:
+            if name not in self._open_sessions:
+                self._open_session(name, now)
+        stale = [name for name, s in self._open_sessions.items() if now - s[1] >= SESSION_HEARTBEAT_SECONDS]
+        if not stale:
+            return
+        self._writer.submit('session_touch', (tuple(stale), now), delay=SESSION_WRITE_DELAY)
+        for name in stale:
+            self._open_sessions[name][1] = now
+
     def get_last_seen_and_sessions(self, start_date=None, end_date=None, gap_minutes=15):
-        """Эвристически вычисляет последнее появление и число сессий по процессам за период.
-        Сессия считается прерванной, если между соседними записями > gap_minutes.
+        """Возвращает последнее появление и число сессий по процессам за период [start_date, end_date).
+        Сессии берутся из таблицы sessions (интервалы по событиям запуска/остановки),
+        поэтому стоимость не зависит от числа сырых записей. gap_minutes оставлен для совместимости:
+        склейка близких запусков выполняется при записи (SESSION_MERGE_SECONDS).
         Возвращает словарь: {proc: {last_seen: 'YYYY-MM-DD HH:MM:SS', sessions: int}}
         """
         if start_date is None:
@@ -223,79 +774,296 @@ class ProcessManager:
             end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         info = {}
         try:
-            with sqlite3.connect(self._usage_db) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT process_name, timestamp
-                    FROM usage_stats
-                    WHERE date(timestamp) >= ? AND date(timestamp) < ?
-                    ORDER BY process_name, timestamp
-                ''', (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
-                rows = cursor.fetchall()
-            from collections import defaultdict
-            grouped = defaultdict(list)
-            for name, ts in rows:
-                grouped[name].append(datetime.strptime(ts, '%Y-%m-%d %H:%M:%S'))
-            for name, times in grouped.items():
-                sessions = 0
-                prev = None
-                for t in times:
-                    if prev is None or (t - prev).total_seconds() > gap_minutes * 60:
-                        sessions += 1
-                    prev = t
-                info[name] = {
-                    'last_seen': times[-1].strftime('%Y-%m-%d %H:%M:%S') if times else None,
-                    'sessions': sessions
-                }
+            sessions = self._range_sessions(start_date, end_date)
+            for name, (count, last_seen) in sessions.items():
+                info[name] = {'last_seen': last_seen, 'sessions': count}
         except Exception as e:
             self.logger.error(f"Error computing last_seen/sessions: {e}")
         return info
 
+    def _range_sessions(self, start_date, end_date):
+        """{process_name: (число сессий, последнее появление 'YYYY-MM-DD HH:MM:SS')} за [start_date, end_date)."""
+        start_ts = int(datetime.combine(start_date, datetime.min.time()).timestamp())
+        end_ts = int(datetime.combine(end_date, datetime.min.time()).timestamp())
+        rows = self._cached('sessions', day_key(start_date), day_key(end_date), 0,
+                            lambda: tuple(self._storage.range_sessions(start_ts, end_ts)))
+        result = {}
+        now = time.time()
+        for name, sessions, last_ts in rows:
+            # Для идущей сейчас игры последнее появление — текущий момент
+            if name in self._open_sessions and start_ts <= now < end_ts:
+                last_ts = now
+            result[name] = (int(sessions or 0), datetime.fromtimestamp(last_ts).strftime('%Y-%m-%d %H:%M:%S'))
+        return result
+
+    def get_dashboard_stats(self, today=None):
+        """Все данные панели статистики за один проход: итоги за день и неделю (с понедельника)
+        и по играм — день, последние 7 дней, сессии и последнее появление.
+        Прошлые дни читаются одним запросом из usage_daily, сегодня — из счётчиков в памяти,
+        сессии — одним запросом к sessions; между записями оба запроса отдаются из кэша.
+        Возвращает DashboardStats.
+        """
+        if today is None:
+            today = datetime.now().date()
+        elif isinstance(today, str):
+            today = datetime.strptime(today, '%Y-%m-%d').date()
+        elif isinstance(today, datetime):
+            today = today.date()
+        today_key = day_key(today)
+        week_key = day_key(today - timedelta(days=today.weekday()))
+        last7_key = day_key(today - timedelta(days=6))
+        end_date = today + timedelta(days=1)
+        # Текущий день берётся из памяти (включая ещё не записанную очередь), поэтому в запросе исключается
+        live = today_key == self._ensure_today()
+        today_total = self._today_total if live else 0
+        played = self.get_daily_play_seconds(today)
+        per_today = dict(self._today_by_process) if live else {}
+        week_total = today_total
+        per_week = dict(per_today)
+        sessions = {}
+        try:
+            start, end, excluded = min(week_key, last7_key), day_key(end_date), today_key if live else 0
+            rows = self._cached('dashboard', start, end, excluded,
+                                lambda: tuple(self._storage.daily_rows(start, end, excluded)))
+            sessions = self._range_sessions(today - timedelta(days=6), end_date)
+            for day, name, seconds in rows:
+                seconds = int(seconds or 0)
+                if day >= week_key:
+                    week_total += seconds
+                if day >= last7_key:
+                    per_week[name] = per_week.get(name, 0) + seconds
+                if day == today_key:
+                    today_total += seconds
+                    per_today[name] = per_today.get(name, 0) + seconds
+        except Exception as e:
+            self.logger.error(f"Error computing dashboard stats: {e}")
+        games = tuple(
+            GameStats(name, per_today.get(name, 0), per_week.get(name, 0),
+                      sessions.get(name, (0, None))[0], sessions.get(name, (0, None))[1])
+            for name in sorted(set(per_today) | set(per_week))
+        )
+        return DashboardStats(today, today_total, week_total, played, games)
+
+    def get_play_patterns(self, start_date=None, end_date=None):
+        """Аналитика привычек за [start_date, end_date) (по умолчанию — последние 365 дней): тепловая карта
+        день недели × час, скользящие средние, доли игр и длительности сессий (usage_analytics.PlayPatterns).
+        Дневные итоги включают сегодняшние счётчики в памяти; тепловая карта строится по почасовым суммам
+        (дни старше usage_hourly_retention_days и записи в очереди писателя в неё не попадают);
+        сессии хранятся usage_retention_days.
+        Возвращает None, если NumPy не установлен или при ошибке.
+        """
+        if not analytics_available():
+            return None
+        if isinstance(end_date, str):
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        end_date = end_date or datetime.now().date() + timedelta(days=1)
+        if isinstance(start_date, str):
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+        start_date = start_date or end_date - timedelta(days=365)
+        try:
+            today = self._ensure_today()
+            start, end = day_key(start_date), day_key(end_date)
+            daily = list(self._cached('daily_rows', start, end, today,
+                                      lambda: tuple(self._storage.daily_rows(start, end, today))))
+            if start <= today < end:
+                daily.extend((today, name, seconds) for name, seconds in self._today_by_process.items())
+            start_ts = int(datetime.combine(start_date, datetime.min.time()).timestamp())
+            end_ts = int(datetime.combine(end_date, datetime.min.time()).timestamp())
+            hourly = self._cached('hourly', start, end, 0, lambda: tuple(self._storage.hourly(start_ts, end_ts)))
+            return analyze(start_date, end_date, daily, hourly, self._storage.session_intervals(start_ts, end_ts))
+        except Exception as e:
+            self.logger.error(f"Error computing play patterns: {e}")
+            return None
+
+    # --- Retention (background maintenance on the writer thread) ---
+    def _retention_days(self, key, default):
+        try:
+            return max(0, int(self.settings.get(key, default)))
+        except (TypeError, ValueError):
+            return default
+
+    def _new_retention_job(self):
+        """Состояние одного прохода обслуживания хранилища (0 дней в настройке — уровень хранится всегда):
+        сырые записи старше usage_retention_days сворачиваются в usage_hourly, почасовые суммы старше
+        usage_hourly_retention_days удаляются; дневные агрегаты usage_daily остаются навсегда.
+        """
+        raw_days = self._retention_days('usage_retention_days', 30)
+        hourly_days = self._retention_days('usage_hourly_retention_days', 365)
+        if not raw_days and not hourly_days:
+            return None
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        raw_cutoff = int((midnight - timedelta(days=raw_days)).timestamp()) if raw_days else None
+        hourly_cutoff = day_key(midnight - timedelta(days=hourly_days)) if hourly_days else None
+        return {'raw_cutoff': raw_cutoff, 'hourly_cutoff': hourly_cutoff,
+                'phase': 'usage_stats' if raw_cutoff is not None else 'usage_hourly', 'started': time.time(),
+                'usage_rows': 0, 'hourly_rows': 0, 'session_rows': 0, 'pages_freed': 0}
+
+    def _retention_step(self, job):
+        """Один шаг обслуживания хранилища (см. UsageStorage.retention_step); каждый шаг — отдельная
+        короткая транзакция. Возвращает True, когда проход завершён (и сохраняет отчёт).
+        """
+        sessions_before = job['session_rows']
+        done = self._storage.retention_step(job, self._cleanup_batch_size, self._vacuum_pages_per_step)
+        if job['session_rows'] != sessions_before:
+            self._range_cache.clear()
+        if not done:
+            return False
+        report = {
+            'usage_rows': job['usage_rows'],
+            'hourly_rows': job['hourly_rows'],
+            'session_rows': job['session_rows'],
+            'pages_freed': job['pages_freed'],
+            'seconds': round(time.time() - job['started'], 3),
+        }
+        self.last_cleanup_report = report
+        self.logger.info(f"Retention compacted {report['usage_rows']} usage rows into hourly buckets, removed "
+                         f"{report['hourly_rows']} hourly rows and {report['session_rows']} sessions, "
+                         f"freed {report['pages_freed']} pages in {report['seconds']:.2f}s")
+        return True
+
+    def _schedule_retention(self):
+        """Ставит проход очистки фоновой задачей писателя (если предыдущий ещё не закончился — пропускает)."""
+        if self._retention_job is not None:
+            return
+        job = self._new_retention_job()
+        if job is None:
+            return
+        self._retention_job = job
+
+        def step():
+            try:
+                done = self._retention_step(job)
+            except Exception:
+                done = True
+                raise
+            finally:
+                if done and self._retention_job is job:
+                    self._retention_job = None
+            return not done
+        self._writer.schedule(step)
+
     def cleanup_old_data(self):
-        """Очистка старых данных из БД"""
+        """Очистка старых данных по политике хранения до конца (в потоке-писателе, после уже
+        поставленных записей). Возвращает отчёт {usage_rows, hourly_rows, session_rows, pages_freed, seconds}
+        или None.
+        """
+        job = self._new_retention_job()
+        if job is None:
+            return None
+
+        def run():
+            while not self._retention_step(job):
+                pass
+            return self.last_cleanup_report
         try:
-            cutoff_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-            with sqlite3.connect(self._usage_db) as conn:
-                cursor = conn.cursor()
-                cursor.execute('DELETE FROM usage_stats WHERE date(timestamp) < ?', (cutoff_date,))
-                conn.commit()
-            self.logger.info("Old data cleaned up")
-        except sqlite3.Error as e:
+            return self._writer.call(run)
+        except Exception as e:
             self.logger.error(f"Error cleaning up old data: {e}")
+            return None
 
-    def is_any_monitored_process_running(self):
-        """Проверяет, запущен ли хотя бы один из отслеживаемых процессов (быстро через пересечение множеств)."""
-        monitored = self._get_monitored_set()
-        if not monitored:
-            return False
-        active = set(self.get_active_processes())
-        if active & monitored:
-            return True
-        # Если прямого совпадения по имени нет, делаем более дорогую проверку по путям (редкий случай)
-        for name in monitored:
-            if self.is_process_running(name):
-                return True
-        return False
+    # --- Export / import (streamed, bounded memory) ---
+    def export_usage(self, path, start_date=None, end_date=None, format=None):
+        """Выгружает статистику за [start_date, end_date) (по умолчанию — всю) в CSV или JSON Lines
+        (format или расширение файла). Строки идут потоком из курсора прямо в файл; для периодов,
+        уже свёрнутых политикой хранения, выгружаются почасовые или дневные суммы.
+        Возвращает число строк или None при ошибке.
+        """
+        try:
+            fmt = detect_format(path, format)
+            self.flush()
+            start_ts = end_ts = None
+            if start_date is not None:
+                if isinstance(start_date, str):
+                    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+                start_ts = int(datetime.combine(start_date, datetime.min.time()).timestamp())
+            if end_date is not None:
+                if isinstance(end_date, str):
+                    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+                end_ts = int(datetime.combine(end_date, datetime.min.time()).timestamp())
+            started = time.time()
+            count = write_rows(self._storage.iter_usage(start_ts, end_ts), path, fmt)
+            self.logger.info(f"Exported {count} usage rows to {path} in {time.time() - started:.2f}s")
+            return count
+        except Exception as e:
+            self.logger.error(f"Error exporting usage to {path}: {e}")
+            return None
 
+    def import_usage(self, path, format=None):
+        """Загружает статистику из файла export_usage (в т.ч. с другого компьютера): файл читается
+        потоком, строки пишутся пачками одной транзакцией в потоке-писателе, дневные агрегаты
+        загруженных дней пересчитываются. Повторная загрузка того же файла ничего не удваивает;
+        дни, уже свёрнутые здесь в почасовые суммы, пропускаются. Сессии не переносятся.
+        Возвращает отчёт {rows, skipped, invalid, days, seconds} или None при ошибке.
+        """
+        try:
+            reader = UsageReader(path, format)
+            started = time.time()
+            imported, skipped, days = self._writer.call(
+                lambda: self._storage.import_usage(reader, self._import_batch_size))
+        except Exception as e:
+            self.logger.error(f"Error importing usage from {path}: {e}")
+            return None
+        self._range_cache.clear()
+        # Загруженные строки могли попасть в сегодняшний день — счётчики засеваются заново
+        self._today = None
+        self._ensure_today()
+        report = {'rows': imported, 'skipped': skipped, 'invalid': reader.invalid, 'days': days,
+                  'seconds': round(time.time() - started, 3)}
+        self.logger.info(f"Imported {imported} usage rows for {days} days from {path} "
+                         f"({skipped} skipped, {reader.invalid} invalid) in {report['seconds']:.2f}s")
+        return report
+
+    def _get_path_matcher(self):
+        """Возвращает (версия, regex) для поиска любого из отслеживаемых имён в имени процесса или пути к exe.
+        Пересобирается только при изменении settings['processes'].
+        """
+        return self._path_matcher
+
+    def _monitored_by_path(self):
+        """Один проход по известным PID: exe разрешается один раз за жизнь PID,
+        результат сопоставления мемоизируется до смены списка отслеживаемых процессов.
+        Возвращает frozenset имён процессов, совпавших по имени или пути.
+        """
+        version, matcher = self._get_path_matcher()
+        if matcher is None:
+            return frozenset()
+        found = set()
+        for entry in list(self._scanner.entries().values()):
+            if entry.match_version != version:
+                matched = bool(entry.name and matcher.search(entry.name))
+                if not matched:
+                    exe = self._scanner.exe(entry)
+                    matched = bool(exe and matcher.search(exe))
+                entry.matched = matched
+                entry.match_version = version
+            if entry.matched:
+                found.add(entry.name)
+        return frozenset(found)
+
+    def is_any_monitored_process_running(self, tick=None):
+        """Проверяет, запущен ли хотя бы один из отслеживаемых процессов (чтение последнего снимка).
+        Если передан tick — используется закреплённый за циклом снимок.
+        """
+        if tick is not None:
+            return tick.any_monitored_running
+        if not self._get_monitored_set():
+            return False
+        return bool(self.snapshot().monitored)
 
     def is_process_running(self, process_name):
-        """Проверяет, запущен ли указанный процесс. Сначала по кэшу имён, затем (если нужно) по путям."""
+        """Проверяет, запущен ли указанный процесс. Сначала по снимку имён, затем (если нужно) по путям."""
         process_lower = (process_name or "").lower()
         if not process_lower:
             return False
-        # Быстрая проверка по кэшу имён
-        if process_lower in self._cache:
+        # Быстрая проверка по снимку имён
+        if process_lower in self.snapshot().names:
             return True
-        # Медленная проверка по путям
-        for proc in psutil.process_iter(['name', 'exe']):
-            try:
-                proc_info = proc.info
-                if not proc_info:
-                    continue
-                name = (proc_info.get('name') or '').lower()
-                exe = (proc_info.get('exe') or '').lower()
-                if process_lower in name or (exe and process_lower in exe):
+        # Проверка по путям известных PID (exe разрешается один раз за жизнь PID)
+        with self._scan_lock:
+            for entry in list(self._scanner.entries().values()):
+                if process_lower in entry.name:
+                    return True
+                exe = self._scanner.exe(entry)
+                if exe and process_lower in exe:
                     return True
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                continue
         return False
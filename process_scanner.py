@@ -0,0 +1,169 @@
+"""
+Файл: process_scanner.py
+
+Модуль инкрементального сканирования таблицы процессов для ProcessManager в приложении Game Timer.
+Вместо полного обхода всех процессов сравнивает множества PID между проходами: имена
+разрешаются только для новых PID, завершившиеся удаляются, а переиспользование PID
+обнаруживается по времени создания процесса.
+"""
+
+import logging
+import time
+from collections import deque, namedtuple
+
+from process_sources import PsutilProcessSource
+
+# Событие запуска/остановки процесса: kind — 'started' | 'stopped'
+ProcessEvent = namedtuple('ProcessEvent', ['kind', 'pid', 'name', 'timestamp'])
+
+# Неизменяемый снимок набора процессов, публикуемый воркером сканирования.
+# names — frozenset имён (lowercase), monitored — frozenset запущенных отслеживаемых имён
+ProcessSnapshot = namedtuple('ProcessSnapshot', ['version', 'taken_at', 'names', 'monitored'])
+
+
+class _ProcEntry:
+    """Запись об известном процессе (имя в lowercase и время создания для контроля переиспользования PID).
+    Путь к exe и результат сопоставления с отслеживаемыми играми мемоизируются на время жизни PID.
+    """
+    __slots__ = ('pid', 'name', 'create_time', 'exe', 'match_version', 'matched')
+
+    def __init__(self, pid, name, create_time):
+        self.pid = pid
+        self.name = name
+        self.create_time = create_time
+        self.exe = None  # None — ещё не разрешали
+        self.match_version = -1
+        self.matched = False
+
+
+class ProcessScanner:
+    """Инкрементальный сканер процессов.
+
+    Стоимость одного прохода в установившемся режиме пропорциональна числу
+    запущенных/завершённых процессов, а не размеру таблицы процессов:
+    список PID + разрешение имён только для новых PID + проверка
+    create_time у отслеживаемых процессов (каждый проход) и у ограниченной
+    порции остальных известных PID (по кругу).
+    Данные берутся из источника ProcessSource (по умолчанию psutil).
+    """
+
+    def __init__(self, source=None, reuse_check_batch=64):
+        self.logger = logging.getLogger('ProcessScanner')
+        self._source = source or PsutilProcessSource()
+        self._entries = {}  # pid -> _ProcEntry
+        self._by_name = {}  # name (lowercase) -> set(pid)
+        self._listeners = []
+        # Сколько известных PID за один проход перепроверять на переиспользование
+        self._reuse_check_batch = max(0, int(reuse_check_batch))
+        self._reuse_queue = deque()
+        self.scan_count = 0
+
+    def add_listener(self, callback):
+        """Подписывает callback(events) на события запуска/остановки процессов."""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        try:
+            self._listeners.remove(callback)
+        except ValueError:
+            pass
+
+    def names(self):
+        """Возвращает представление имён запущенных процессов (lowercase)."""
+        return self._by_name.keys()
+
+    def pids_for(self, name):
+        """Возвращает множество PID для имени процесса (lowercase)."""
+        return self._by_name.get(name, set())
+
+    def entries(self):
+        """Возвращает словарь {pid: _ProcEntry} известных процессов (только для чтения)."""
+        return self._entries
+
+    def scan(self, watched=()):
+        """Выполняет один инкрементальный проход. Возвращает список событий ProcessEvent.
+        watched — имена (lowercase), PID которых проверяются на переиспользование каждый проход,
+        как и записи, совпавшие по пути (entry.matched): завершение игры не должно теряться,
+        если её PID сразу занял другой процесс.
+        """
+        now = time.time()
+        current = set(self._source.pids())
+        known = self._entries
+        events = []
+
+        # 1) Завершившиеся процессы
+        for pid in [pid for pid in known if pid not in current]:
+            events.append(self._drop(pid, now))
+
+        # 2) Переиспользованные PID: тот же номер, другое время создания.
+        #    Отслеживаемые — каждый проход, остальные — порцией по кругу
+        priority = {pid for pid, entry in known.items() if entry.matched or entry.name in watched}
+        for pid in [*priority, *(pid for pid in self._next_reuse_candidates() if pid not in priority)]:
+            entry = known.get(pid)
+            if entry is None:
+                continue
+            create_time = self._source.identity(pid)
+            if create_time is None or create_time != entry.create_time:
+                events.append(self._drop(pid, now))
+
+        # 3) Новые процессы — единственное место, где разрешаются имена
+        for pid in current:
+            if pid in known:
+                continue
+            entry = self._resolve(pid)
+            if entry is None:
+                continue
+            known[pid] = entry
+            if entry.name:
+                self._by_name.setdefault(entry.name, set()).add(pid)
+                events.append(ProcessEvent('started', pid, entry.name, now))
+
+        self.scan_count += 1
+        events = [e for e in events if e is not None]
+        if events:
+            self._emit(events)
+        return events
+
+    def _drop(self, pid, now):
+        entry = self._entries.pop(pid, None)
+        if entry is None or not entry.name:
+            return None
+        pids = self._by_name.get(entry.name)
+        if pids is not None:
+            pids.discard(pid)
+            if not pids:
+                del self._by_name[entry.name]
+        return ProcessEvent('stopped', pid, entry.name, now)
+
+    def exe(self, entry):
+        """Возвращает путь к exe процесса (lowercase), разрешая его не более одного раза за жизнь PID."""
+        if entry.exe is None:
+            entry.exe = (self._source.exe(entry.pid) or '').lower()
+        return entry.exe
+
+    def _next_reuse_candidates(self):
+        """Отдаёт очередную порцию известных PID для проверки create_time (по кругу)."""
+        if not self._reuse_check_batch or not self._entries:
+            return []
+        if not self._reuse_queue:
+            self._reuse_queue.extend(self._entries.keys())
+        batch = []
+        while self._reuse_queue and len(batch) < self._reuse_check_batch:
+            batch.append(self._reuse_queue.popleft())
+        return batch
+
+    def _resolve(self, pid):
+        info = self._source.info(pid)
+        if info is None:
+            return None
+        create_time, name = info
+        # PID без имени (нет доступа) тоже запоминаем, чтобы не разрешать его на каждом проходе
+        return _ProcEntry(pid, (name or '').lower(), create_time)
+
+    def _emit(self, events):
+        for callback in list(self._listeners):
+            try:
+                callback(events)
+            except Exception as e:
+                self.logger.error(f"Process event listener failed: {e}")
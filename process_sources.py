@@ -0,0 +1,204 @@
+"""
+Файл: process_sources.py
+
+Источники данных о процессах для ProcessScanner в приложении Game Timer.
+PsutilProcessSource — реализация по умолчанию (Windows/Linux/macOS).
+ProcfsProcessSource — прямое чтение /proc на Linux без построения объектов psutil.Process;
+выдаёт те же значения (имя, время создания, путь к exe), что и psutil.
+"""
+
+import logging
+import os
+import sys
+
+import psutil
+
+
+class ProcessSource:
+    """Интерфейс источника процессов.
+
+    pids()          -> список PID
+    info(pid)       -> (create_time, name) или None, если процесс уже завершился;
+                       name — '' при отказе в доступе
+    identity(pid)   -> create_time, 0.0 при отказе в доступе или None, если процесса нет
+    exe(pid)        -> путь к исполняемому файлу, '' если недоступен
+    """
+
+    name = 'base'
+
+    def pids(self):
+        raise NotImplementedError
+
+    def info(self, pid):
+        raise NotImplementedError
+
+    def identity(self, pid):
+        raise NotImplementedError
+
+    def exe(self, pid):
+        raise NotImplementedError
+
+
+class PsutilProcessSource(ProcessSource):
+    """Источник на psutil (по умолчанию)."""
+
+    name = 'psutil'
+
+    def pids(self):
+        return psutil.pids()
+
+    def info(self, pid):
+        try:
+            proc = psutil.Process(pid)
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return None
+        except psutil.AccessDenied:
+            return 0.0, ''
+        try:
+            create_time = proc.create_time()
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return None
+        except psutil.AccessDenied:
+            create_time = 0.0
+        try:
+            name = proc.name() or ''
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return None
+        except psutil.AccessDenied:
+            name = ''
+        return create_time, name
+
+    def identity(self, pid):
+        try:
+            return psutil.Process(pid).create_time()
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return None
+        except psutil.AccessDenied:
+            return 0.0
+
+    def exe(self, pid):
+        try:
+            return psutil.Process(pid).exe() or ''
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess, OSError):
+            return ''
+
+
+class ProcfsProcessSource(ProcessSource):
+    """Источник, читающий /proc напрямую (только Linux).
+
+    Каталог перечисляется одним os.scandir, для каждого нового PID читается
+    один файл stat (в нём же поле comm — то же значение, что и в /proc/<pid>/comm),
+    и лишь для имён длиной 15+ символов — cmdline, как это делает psutil.
+    Чтение идёт через os.readv в один переиспользуемый буфер.
+    """
+
+    name = 'procfs'
+    _COMM_LEN = 15  # ядро обрезает comm до 15 символов
+
+    def __init__(self, root='/proc', buffer_size=4096):
+        self._root = root
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._clock_ticks = os.sysconf('SC_CLK_TCK')
+        self._boot_time = self._read_boot_time()
+
+    def _read_boot_time(self):
+        with open(os.path.join(self._root, 'stat'), 'rb') as f:
+            for line in f:
+                if line.startswith(b'btime'):
+                    return float(line.split()[1])
+        raise RuntimeError(f"btime not found in {self._root}/stat")
+
+    def _read(self, path):
+        """Читает начало файла в общий буфер. None — файла нет (процесс завершился)."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        except ProcessLookupError:
+            return None
+        try:
+            n = os.readv(fd, [self._buf])
+        except (ProcessLookupError, OSError):
+            return None
+        finally:
+            os.close(fd)
+        return bytes(self._view[:n])
+
+    def pids(self):
+        with os.scandir(self._root) as it:
+            return [int(entry.name) for entry in it if entry.name.isdigit()]
+
+    def _parse_stat(self, pid):
+        """(create_time, comm) из /proc/<pid>/stat; None — процесса нет;
+        (0.0, '') — нет доступа (например, hidepid), как AccessDenied у psutil.
+        """
+        try:
+            data = self._read(f"{self._root}/{pid}/stat")
+        except PermissionError:
+            return 0.0, ''
+        if not data:
+            return None
+        lpar = data.find(b'(')
+        rpar = data.rfind(b')')
+        comm = data[lpar + 1:rpar].decode(sys.getfilesystemencoding(), 'surrogateescape')
+        fields = data[rpar + 2:].split()
+        create_time = (float(fields[19]) / self._clock_ticks) + self._boot_time
+        return create_time, comm
+
+    def _cmdline(self, pid):
+        data = self._read(f"{self._root}/{pid}/cmdline")
+        if not data:
+            return []
+        data = data.decode(sys.getfilesystemencoding(), 'surrogateescape')
+        sep = '\x00' if data.endswith('\x00') else ' '
+        if data.endswith(sep):
+            data = data[:-1]
+        return data.split(sep)
+
+    def info(self, pid):
+        parsed = self._parse_stat(pid)
+        if parsed is None:
+            return None
+        create_time, name = parsed
+        if len(name) >= self._COMM_LEN:
+            # Как psutil: восстанавливаем полное имя из argv[0], если оно начинается с comm
+            try:
+                cmdline = self._cmdline(pid)
+            except PermissionError:
+                cmdline = []
+            if cmdline:
+                extended = os.path.basename(cmdline[0])
+                if extended.startswith(name):
+                    name = extended
+        return create_time, name
+
+    def identity(self, pid):
+        parsed = self._parse_stat(pid)
+        return parsed[0] if parsed is not None else None
+
+    def exe(self, pid):
+        try:
+            path = os.readlink(f"{self._root}/{pid}/exe")
+        except OSError:
+            return ''
+        path = path.split('\x00')[0]
+        if path.endswith(' (deleted)') and not os.path.exists(path):
+            path = path[:-10]
+        return path
+
+
+def create_process_source(kind=None):
+    """Создаёт источник процессов по имени из настроек: 'psutil' (по умолчанию) или 'procfs'.
+    Если procfs недоступен на этой платформе — возвращается psutil.
+    """
+    kind = (kind or 'psutil').strip().lower()
+    if kind == 'procfs':
+        if sys.platform.startswith('linux') and os.path.isdir('/proc'):
+            try:
+                return ProcfsProcessSource()
+            except Exception as e:
+                logging.getLogger('ProcessSources').error(f"procfs source unavailable, falling back to psutil: {e}")
+        else:
+            logging.getLogger('ProcessSources').warning("procfs source is Linux-only, falling back to psutil")
+    return PsutilProcessSource()
@@ -0,0 +1,83 @@
+"""
+Файл: range_cache.py
+
+LRU-кэш результатов запросов статистики по диапазонам дней для ProcessManager в приложении Game Timer.
+Ключ — (вид запроса, первый день, день после последнего, исключённый день) в формате YYYYMMDD.
+Записи сбрасываются точечно: после каждой транзакции писателя — только те, чей диапазон
+содержит изменённые дни, поэтому результаты за прошлые дни живут до вытеснения.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class RangeCache:
+    """Потокобезопасный LRU-кэш с поколениями.
+
+    Вычисление, начатое до инвалидации, не попадает в кэш: put() принимает поколение,
+    полученное перед запросом к БД, и игнорирует результат, если с тех пор что-то сбрасывалось.
+    """
+
+    def __init__(self, maxsize=256):
+        self._maxsize = max(1, int(maxsize))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Возвращает (True, значение) или (False, None)."""
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_days(self, days, kinds=None, exclude_kinds=()):
+        """Сбрасывает записи, диапазон которых содержит любой из дней (кроме исключённого в ключе дня).
+        kinds — сбрасывать только эти виды запросов, exclude_kinds — все, кроме этих.
+        """
+        if not days:
+            return
+        with self._lock:
+            self.generation += 1
+            stale = [
+                key for key in self._entries
+                if (kinds is None or key[0] in kinds) and key[0] not in exclude_kinds
+                and any(key[1] <= day < key[2] and day != key[3] for day in days)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'size': len(self._entries),
+                'invalidations': self.invalidations,
+            }
@@ -4,20 +4,36 @@
 Модуль для загрузки, сохранения и управления настройками пользователя в приложении Game Timer.
 """
 
+import atexit
 import json
 import os
-import time
+import threading
 from logger import Logger
 
+_MISSING = object()
+
 class SettingsManager:
     def __init__(self, filename="settings.json"):
         self.filename = filename
         self.settings = {}
         self.logger = Logger("SettingsManager")
-        # Вспомогательные поля для троттлинга сохранений
-        self._last_save_ts = 0.0
-        self._save_interval_sec = 5.0  # не чаще одного сохранения в 5 секунд
-        self._last_saved_snapshot = None
+        # Отложенная запись: изменения за окно _save_delay_sec сливаются в одну запись файла,
+        # которую выполняет таймер; flush() записывает сразу (при выходе и через atexit)
+        self._lock = threading.RLock()
+        # Запись файла идёт вне _lock (set() из GUI не ждёт диска); _write_lock упорядочивает сами записи
+        self._write_lock = threading.Lock()
+        self._save_delay_sec = 2.0
+        self._save_timer = None
+        # Пауза перед повтором неудачной записи (удваивается до _save_retry_max_sec)
+        self._save_retry_sec = self._save_delay_sec
+        self._save_retry_max_sec = 60.0
+        # Счётчик изменений: set() увеличивает _version, запись файла запоминает сохранённую версию,
+        # поэтому проверка «есть ли что сохранять» — сравнение двух чисел без сериализации
+        self._version = 0
+        self._saved_version = 0
+        # Подписчики на изменения: (множество ключей, callback(key, value))
+        self._subscribers = []
+        atexit.register(self.flush)
         self.default_settings = {
             "mode": "timer",
             "hours": 2,
@@ -34,6 +50,17 @@ class SettingsManager:
             # Интервалы/задержки в миллисекундах
             "periodic_tasks_interval_ms": 1000,
             "process_check_interval_ms": 5000,
+            "process_snapshot_max_age_ms": 10000,
+            "process_source": "psutil",
+            "process_scan_min_interval_ms": 500,
+            "process_scan_max_interval_ms": 20000,
+            "process_scan_fast_window_sec": 10,
+            "process_scan_idle_after_sec": 120,
+            "process_scan_fast_before_expiry_sec": 60,
+            "usage_retention_days": 30,
+            "usage_hourly_retention_days": 365,
+            "usage_storage": "sqlite",
+            "usage_db_path": "usage_stats.db",
             "notification_check_delay_ms": 10000,
             "notification_countdown_seconds": 15,
             "passive_logging_interval_ms": 600000,
@@ -86,6 +113,17 @@ class SettingsManager:
                 "check_interval": "Интервал (сек) для некоторых проверок в приложении",
                 "periodic_tasks_interval_ms": "Период (мс) запуска фоновых задач UI (1 000 = 1 сек)",
                 "process_check_interval_ms": "Период (мс) сканирования запущенных процессов (5 000 = каждые 5 сек)",
+                "process_source": "Источник данных о процессах: 'psutil' (по умолчанию) или 'procfs' (прямое чтение /proc, только Linux)",
+                "process_snapshot_max_age_ms": "Максимальный возраст (мс) снимка процессов из фонового потока; более старый снимок обновляется синхронно",
+                "process_scan_min_interval_ms": "Нижняя граница (мс) интервала сканирования: используется сразу после появления новых процессов и в конце обратного отсчёта",
+                "process_scan_max_interval_ms": "Верхняя граница (мс) интервала сканирования в простое, когда игр давно не было",
+                "process_scan_fast_window_sec": "Сколько секунд сканировать с минимальным интервалом после появления процесса с ещё не встречавшимся именем (или отслеживаемой игры)",
+                "process_scan_idle_after_sec": "Через сколько секунд без отслеживаемых игр сканирование переходит в режим простоя",
+                "process_scan_fast_before_expiry_sec": "За сколько секунд до конца обратного отсчёта включать частое сканирование",
+                "usage_retention_days": "Через сколько дней подробные записи статистики сворачиваются в почасовые суммы, а сессии удаляются (0 — хранить всё)",
+                "usage_hourly_retention_days": "Сколько дней хранить почасовые суммы; дневные итоги хранятся всегда (0 — хранить всё)",
+                "usage_storage": "Хранилище статистики: sqlite (файл БД) или memory (только в памяти, для тестов и симуляций)",
+                "usage_db_path": "Путь к файлу БД статистики; относительный путь считается от папки приложения",
                 "notification_check_delay_ms": "Через сколько мс после уведомления проверить, закрыта ли игра (по умолчанию 10 000)",
                 "notification_countdown_seconds": "Сколько секунд показывать обратный отсчёт перед блокировкой",
                 "passive_logging_interval_ms": "Раз в сколько мс писать пассивные записи логов (600 000 = 10 минут)",
@@ -118,7 +156,8 @@ class SettingsManager:
                     self.logger.info("Settings loaded successfully")
             else:
                 self.settings = self.default_settings.copy()
-                self.save()
+                self._version += 1
+                self.flush()
                 self.logger.info("Created default settings")
         except json.JSONDecodeError as e:
             self.logger.error(f"Error loading settings: Invalid JSON format. {e}")
@@ -128,25 +167,74 @@ class SettingsManager:
             self.settings = self.default_settings.copy()
 
     def save(self):
-        """Сохраняет настройки в файл"""
-        try:
-            # Преобразуем объекты типа set в list перед сохранением
-            settings_to_save = self._convert_sets_to_lists(self.settings)
-            # Избегаем лишних записей, если ничего не изменилось
-            current_snapshot = json.dumps(settings_to_save, sort_keys=True, ensure_ascii=False)
-            if self._last_saved_snapshot == current_snapshot:
-                return
-            # Троттлинг частых сохранений
-            now = time.time()
-            if (now - self._last_save_ts) < self._save_interval_sec:
-                return
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump(settings_to_save, f, indent=4, ensure_ascii=False)
-            self._last_saved_snapshot = current_snapshot
-            self._last_save_ts = now
+        """Планирует запись изменённых настроек в файл не позже чем через _save_delay_sec.
+        Все изменения до срабатывания таймера сливаются в одну запись последнего состояния;
+        если после последней записи set() ничего не менял, вызов ничего не делает (O(1)).
+        Вложенные значения, изменённые на месте, нужно передать через set().
+        """
+        if self._version == self._saved_version:
+            return
+        with self._lock:
+            if self._version != self._saved_version and self._save_timer is None:
+                self._start_save_timer(self._save_delay_sec)
+
+    def _start_save_timer(self, delay):
+        self._save_timer = threading.Timer(delay, self._flush_from_timer)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _flush_from_timer(self):
+        """Запись по таймеру; при ошибке (файл занят антивирусом или редактором) повторяется с нарастающей паузой."""
+        if self.flush():
+            self._save_retry_sec = self._save_delay_sec
+            return
+        with self._lock:
+            if self._version != self._saved_version and self._save_timer is None:
+                self._save_retry_sec = min(self._save_retry_sec * 2, self._save_retry_max_sec)
+                self._start_save_timer(self._save_retry_sec)
+
+    def flush(self):
+        """Немедленно записывает отложенные изменения. Возвращает False при ошибке записи.
+        Под _lock снимается только копия настроек и её версия; json.dump, fsync и подмена файла
+        идут без неё. Снимок берётся под _write_lock, поэтому файл не откатится к более старой версии.
+        """
+        with self._write_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                version = self._version
+                if version == self._saved_version:
+                    return True
+                # Копия с set → list: дальше её можно сериализовать, пока set() меняет настройки
+                data = self._convert_sets_to_lists(self.settings)
+            try:
+                self._write_atomic(data)
+            except Exception as e:
+                # Состояние остаётся изменённым: запись по таймеру повторится сама (см. _flush_from_timer),
+                # прямой вызов flush() сообщает об ошибке вызывающему
+                self.logger.error(f"Error saving settings: {e}")
+                return False
+            with self._lock:
+                self._saved_version = version
             self.logger.debug("Settings saved successfully")
-        except Exception as e:
-            self.logger.error(f"Error saving settings: {e}")
+            return True
+
+    def _write_atomic(self, data):
+        """Пишет файл рядом во временный, сбрасывает на диск и подменяет целиком:
+        при сбое на диске остаётся либо старая, либо новая версия настроек.
+        """
+        tmp_path = f"{self.filename}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.filename)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
     def _convert_sets_to_lists(self, data):
         """Рекурсивно преобразует все объекты типа set в list"""
@@ -163,6 +251,33 @@ class SettingsManager:
         return self.settings.get(key, default)
 
     def set(self, key, value):
-        """Устанавливает значение настройки"""
-        self.settings[key] = value
-        self.save()
\ No newline at end of file
+        """Устанавливает значение настройки; файл обновится отложенно (см. save)"""
+        with self._lock:
+            current = self.settings.get(key, _MISSING)
+            # Равное значение не считается изменением (тот же объект мог быть изменён на месте — он считается)
+            if current is not value and current == value:
+                return
+            self.settings[key] = value
+            self._version += 1
+            self.save()
+            subscribers = [callback for keys, callback in self._subscribers if key in keys]
+        # Подписчики вызываются вне блокировки: им можно читать и менять настройки
+        for callback in subscribers:
+            try:
+                callback(key, value)
+            except Exception as e:
+                self.logger.error(f"Error in settings subscriber for '{key}': {e}")
+
+    def subscribe(self, keys, callback):
+        """Подписывает callback(key, value) на изменения ключей keys (строка или набор строк) через set().
+        Позволяет один раз пересчитать производные значения при изменении, а не читать настройки в каждом цикле.
+        Возвращает callback (для unsubscribe).
+        """
+        keys = frozenset([keys] if isinstance(keys, str) else keys)
+        with self._lock:
+            self._subscribers.append((keys, callback))
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [(keys, cb) for keys, cb in self._subscribers if cb != callback]
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""
+Файл: usage_analytics.py
+
+Аналитика игровых привычек для вкладки статистики приложения Game Timer.
+Данные периода один раз загружаются в массивы NumPy, дальше всё считается
+векторно: тепловая карта «день недели × час», скользящие средние за 7 и 28 дней,
+доля каждой игры и распределение длительности сессий.
+
+NumPy — необязательная зависимость: без него analytics_available() возвращает False,
+а вкладка аналитики показывает подсказку вместо графиков.
+"""
+
+import time
+from collections import namedtuple
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Границы корзин длительности сессий, секунды: <15 мин, 15–30 мин, 30–60 мин, 1–2 ч, 2 ч и больше
+SESSION_BINS = (0, 15 * 60, 30 * 60, 60 * 60, 2 * 60 * 60)
+
+# Итоги аналитики за период [start, end):
+# days — даты периода; games — игры по убыванию общего времени;
+# daily — секунды [день, игра]; totals — секунды по играм; share — доля игр (0..1);
+# heatmap — секунды [день недели (пн = 0), час]; rolling7/rolling28 — среднее время в день за окно,
+# заканчивающееся каждым днём периода; sessions — SessionStats по играм;
+# session_histogram — число сессий в корзинах SESSION_BINS
+PlayPatterns = namedtuple('PlayPatterns', 'start end days games daily totals share heatmap '
+                                          'rolling7 rolling28 sessions session_histogram')
+SessionStats = namedtuple('SessionStats', 'name count median p90 longest')
+
+
+def analytics_available():
+    return np is not None
+
+
+def _epoch_days(day_keys):
+    """Ключи дней YYYYMMDD -> номера дней от 1970-01-01 (векторно)."""
+    years = (day_keys // 10000 - 1970).astype('datetime64[Y]')
+    months = years.astype('datetime64[M]') + (day_keys // 100 % 100 - 1)
+    return (months.astype('datetime64[D]') + (day_keys % 100 - 1)).astype(np.int64)
+
+
+def _rolling_mean(values, window):
+    """Среднее за последние window дней для каждого дня (в начале периода — по имеющимся дням)."""
+    sums = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(0, ends - window)
+    return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+def _local_offsets(ts):
+    """Смещение местного времени от UTC (секунды) для каждого момента массива ts.
+    localtime вызывается дважды на каждые UTC-сутки, а не на строку; построчно уточняются
+    только сутки, в которых смещение меняется (переход на летнее/зимнее время).
+    """
+    days, inverse = np.unique(ts // 86400, return_inverse=True)
+    starts = np.fromiter((time.localtime(int(day) * 86400).tm_gmtoff for day in days), np.int64, len(days))
+    ends = np.fromiter((time.localtime(int(day) * 86400 + 86399).tm_gmtoff for day in days), np.int64, len(days))
+    offsets = starts[inverse]
+    for index in np.flatnonzero((starts != ends)[inverse]):
+        offsets[index] = time.localtime(int(ts[index])).tm_gmtoff
+    return offsets
+
+
+def _heatmap(hourly_rows):
+    """Секунды по ячейкам «день недели (пн = 0) × час» местного времени (вектор из 7 * 24).
+    Почасовые суммы хранятся по UTC-часам; при смещении пояса не кратном часу (например, +5:30)
+    секунды делятся между двумя местными часами пропорционально.
+    """
+    hours = np.fromiter((hour for hour, _ in hourly_rows), np.int64, len(hourly_rows))
+    seconds = np.fromiter((seconds for _, seconds in hourly_rows), np.float64, len(hourly_rows))
+    offsets = _local_offsets(hours)
+    local_hour = (hours + offsets) // 3600  # номер местного часа от 1970-01-01
+    tail = (offsets % 3600) / 3600.0  # доля UTC-часа, попадающая в следующий местный час
+    heatmap = np.zeros(7 * 24)
+    for shift, weights in ((0, 1.0 - tail), (1, tail)):
+        cell_hour = local_hour + shift
+        # 1970-01-01 — четверг (3, если понедельник — 0)
+        cells = (cell_hour // 24 + 3) % 7 * 24 + cell_hour % 24
+        heatmap += np.bincount(cells, weights=seconds * weights, minlength=7 * 24)
+    return heatmap
+
+
+def _columns(rows, names, index, count):
+    """Разворачивает строки (..., name, seconds) в массивы; имена заменяются номерами игр."""
+    columns = list(zip(*rows)) if rows else [()] * count
+    games = np.fromiter((index.setdefault(name, len(index)) for name in columns[names]), np.int64,
+                        len(columns[names]))
+    return columns, games
+
+
+def analyze(start, end, daily_rows, hourly_rows, sessions):
+    """Считает PlayPatterns за [start, end) (date).
+
+    daily_rows  — (day, name, seconds) из дневных агрегатов (все уровни хранения);
+    hourly_rows — (hour_ts, seconds) по всем играм (для тепловой карты, не больше 8760 строк в год);
+    sessions    — (name, start_ts, end_ts).
+    """
+    if np is None:
+        raise RuntimeError("numpy is not installed")
+    n_days = max(0, (end - start).days)
+    start_epoch = (start - date(1970, 1, 1)).days
+    index = {}
+
+    # Дневная матрица [день, игра]
+    columns, games = _columns(list(daily_rows), 1, index, 3)
+    day_keys = np.fromiter(columns[0], np.int64, len(columns[0]))
+    seconds = np.fromiter(columns[2], np.float64, len(columns[2]))
+    offsets = _epoch_days(day_keys) - start_epoch
+    inside = (offsets >= 0) & (offsets < n_days)
+
+    # Тепловая карта «день недели × час» по местному времени
+    heatmap = _heatmap(list(hourly_rows))
+
+    # Сессии
+    sessions = list(sessions)
+    x_columns, x_games = _columns(sessions, 0, index, 3)
+    x_start = np.fromiter(x_columns[1], np.int64, len(x_columns[1]))
+    x_end = np.fromiter(x_columns[2], np.int64, len(x_columns[2]))
+    durations = np.maximum(0, x_end - x_start)
+
+    n_games = len(index)
+    daily = np.zeros((n_days, n_games))
+    np.add.at(daily, (offsets[inside], games[inside]), seconds[inside])
+    totals = daily.sum(axis=0)
+    # Игры по убыванию общего времени; игры только с сессиями — в конце
+    order = np.lexsort((np.arange(n_games), -totals))
+    names = [None] * n_games
+    for name, game in index.items():
+        names[game] = name
+    daily = daily[:, order]
+    totals = totals[order]
+    grand_total = totals.sum()
+    share = totals / grand_total if grand_total else np.zeros(n_games)
+    per_day = daily.sum(axis=1)
+
+    session_stats = []
+    histogram = np.zeros(len(SESSION_BINS), dtype=np.int64)
+    if len(durations):
+        histogram = np.bincount(np.searchsorted(SESSION_BINS, durations, side='right') - 1,
+                                minlength=len(SESSION_BINS))
+        by_game = np.lexsort((durations, x_games))
+        sorted_games = x_games[by_game]
+        sorted_durations = durations[by_game]
+        bounds = np.flatnonzero(np.diff(sorted_games)) + 1
+        for chunk_games, chunk in zip(np.split(sorted_games, bounds), np.split(sorted_durations, bounds)):
+            p50, p90 = np.percentile(chunk, (50, 90))
+            session_stats.append(SessionStats(names[chunk_games[0]], len(chunk), int(p50), int(p90), int(chunk[-1])))
+        rank = {names[game]: position for position, game in enumerate(order.tolist())}
+        session_stats.sort(key=lambda stats: rank[stats.name])
+
+    return PlayPatterns(
+        start=start,
+        end=end,
+        days=np.arange(start_epoch, start_epoch + n_days).astype('datetime64[D]'),
+        games=tuple(names[game] for game in order.tolist()),
+        daily=daily,
+        totals=totals,
+        share=share,
+        heatmap=heatmap.reshape(7, 24),
+        rolling7=_rolling_mean(per_day, 7),
+        rolling28=_rolling_mean(per_day, 28),
+        sessions=tuple(session_stats),
+        session_histogram=histogram,
+    )
@@ -0,0 +1,129 @@
+"""
+Файл: usage_export.py
+
+Форматы выгрузки и загрузки статистики для ProcessManager в приложении Game Timer.
+Строки (ts, day, process_name, seconds) пишутся и читаются потоково, по одной,
+поэтому объём памяти не зависит от размера истории.
+
+Форматы:
+    csv   — таблица с заголовком (UTF-8 с BOM, чтобы Excel правильно показал кириллицу)
+    jsonl — JSON Lines, по объекту на строку
+Поля: ts (epoch-секунды), datetime (местное время), day (YYYY-MM-DD), process_name, seconds.
+"""
+
+import csv
+import functools
+import json
+import logging
+import os
+from datetime import datetime
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('ts', 'datetime', 'day', 'process_name', 'seconds')
+_EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+def detect_format(path, fmt=None):
+    """Формат из аргумента или расширения файла; ValueError, если определить не удалось."""
+    fmt = (fmt or _EXTENSIONS.get(os.path.splitext(path)[1].lower(), '')).lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown usage export format for {path!r}, expected one of {', '.join(FORMATS)}")
+    return fmt
+
+
+# Дней в истории немного, а строк — миллионы: преобразования дня кэшируются
+@functools.lru_cache(maxsize=4096)
+def _day_text(day):
+    return f"{day // 10000:04d}-{day // 100 % 100:02d}-{day % 100:02d}"
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_day_text(value):
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    year, month, day = (int(part) for part in value.split('-'))
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        raise ValueError(f"invalid day {value!r}")
+    return year * 10000 + month * 100 + day
+
+
+def _parse_day(value, ts):
+    if value in (None, ''):
+        now = datetime.fromtimestamp(ts)
+        return now.year * 10000 + now.month * 100 + now.day
+    if isinstance(value, int):
+        return value
+    return _parse_day_text(str(value))
+
+
+def write_rows(rows, path, fmt):
+    """Записывает строки (ts, day, process_name, seconds) в файл; возвращает их число.
+    Файл пишется рядом во временный и подменяется целиком, только когда выгрузка завершена.
+    """
+    tmp_path = f"{path}.tmp"
+    count = 0
+    try:
+        if fmt == 'csv':
+            with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(FIELDS)
+                for ts, day, name, seconds in rows:
+                    writer.writerow((ts, datetime.fromtimestamp(ts).isoformat(' '),
+                                     _day_text(day), name, seconds))
+                    count += 1
+        else:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for ts, day, name, seconds in rows:
+                    record = dict(zip(FIELDS, (ts, datetime.fromtimestamp(ts).isoformat(' '),
+                                               _day_text(day), name, seconds)))
+                    f.write(json.dumps(record, ensure_ascii=False))
+                    f.write('\n')
+                    count += 1
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+class UsageReader:
+    """Итератор строк (ts, day, process_name, seconds) из файла выгрузки.
+    Некорректные строки пропускаются и считаются в invalid.
+    """
+
+    def __init__(self, path, fmt=None):
+        self.logger = logging.getLogger('UsageReader')
+        self.path = path
+        self.format = detect_format(path, fmt)
+        self.invalid = 0
+
+    def _records(self):
+        if self.format == 'csv':
+            with open(self.path, 'r', encoding='utf-8-sig', newline='') as f:
+                yield from csv.DictReader(f)
+        else:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield None
+
+    def __iter__(self):
+        for line_no, record in enumerate(self._records(), start=1):
+            try:
+                ts = int(record['ts'])
+                name = str(record['process_name']).strip()
+                seconds = int(record['seconds'])
+                if not name or seconds < 0:
+                    raise ValueError("empty name or negative duration")
+                yield ts, _parse_day(record.get('day'), ts), name, seconds
+            except (TypeError, KeyError, ValueError) as e:
+                self.invalid += 1
+                if self.invalid <= 10:
+                    self.logger.warning(f"Skipping invalid record {line_no} in {self.path}: {e}")
@@ -0,0 +1,199 @@
+"""
+Файл: usage_journal.py
+
+Журнал записей статистики для ProcessManager в приложении Game Timer.
+Каждая строка usage_stats, поставленная в очередь на запись в БД, сначала
+дописывается в небольшой файл фиксированных записей, отображённый в память (mmap).
+При старте записи, не дошедшие до SQLite (сбой, отключение питания), проигрываются
+заново; после каждой успешной транзакции журнал обнуляется сменой «эпохи» в заголовке.
+
+Файл журнала открывается монопольно (fcntl.flock / msvcrt.locking): второй процесс
+(например, usage_tool.py при запущенном приложении) получает JournalLocked:
+ProcessManager работает без журнала, а usage_tool.py отказывается запускаться.
+
+Формат файла:
+    заголовок  (16 байт): magic 'GTJ1', версия, размер записи, эпоха
+    записи    (128 байт): эпоха, seq, ts, day, duration, длина имени, имя (utf-8), crc32
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+_MAGIC = b'GTJ1'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHI4x')
+_RECORD_BODY = struct.Struct('<IQqiiH94s')
+_CRC = struct.Struct('<I')
+RECORD_SIZE = _RECORD_BODY.size + _CRC.size  # 128
+NAME_MAX_BYTES = 94
+# msvcrt.locking блокирует диапазон байт; байт далеко за концом файла не мешает отображению в память
+_LOCK_OFFSET = 0x7FFFFFFF
+
+
+class JournalLocked(OSError):
+    """Журнал уже открыт другим процессом."""
+
+
+class UsageJournal:
+    """Append-only журнал строк (ts, day, process_name, duration).
+
+    append()       -> seq записи (или None, если имя не помещается в запись)
+    committed(seq) -> всё до seq включительно записано в БД; если в журнале больше
+                      ничего нет — он обнуляется
+    replay()       -> действительные записи текущей эпохи (для проигрывания при старте)
+    reset()        -> обнуляет журнал
+    """
+
+    def __init__(self, path, capacity=1024, sync=True):
+        self.logger = logging.getLogger('UsageJournal')
+        self.path = path
+        # sync=True: каждая запись сбрасывается на диск (msync одной страницы), иначе — только в кэш ОС
+        self._sync = sync
+        self._lock = threading.Lock()
+        self._file = None
+        self._mm = None
+        self._epoch = 0
+        self._count = 0
+        self._seq = 0
+        self._open(max(16, int(capacity)))
+
+    def _open(self, capacity):
+        exists = os.path.exists(self.path)
+        self._file = open(self.path, 'r+b' if exists else 'w+b')
+        try:
+            self._lock_file()
+        except JournalLocked:
+            self._file.close()
+            self._file = None
+            raise
+        size = os.fstat(self._file.fileno()).st_size
+        header = None
+        if size >= _HEADER.size:
+            self._file.seek(0)
+            header = _HEADER.unpack(self._file.read(_HEADER.size))
+        if header is None or header[0] != _MAGIC or header[1] != _VERSION or header[2] != RECORD_SIZE:
+            if size:
+                self.logger.warning(f"Unrecognized journal {self.path}, starting a new one")
+            self._file.seek(0)
+            self._file.truncate(0)
+            self._file.write(_HEADER.pack(_MAGIC, _VERSION, RECORD_SIZE, 0))
+            size = _HEADER.size
+        else:
+            self._epoch = header[3]
+        wanted = _HEADER.size + capacity * RECORD_SIZE
+        if size < wanted:
+            self._file.truncate(wanted)
+        self._file.flush()
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+    def _lock_file(self):
+        """Берёт монопольную блокировку файла без ожидания; JournalLocked, если она уже у другого процесса.
+        Блокировка снимается при закрытии файла.
+        """
+        fd = self._file.fileno()
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elif msvcrt is not None:
+                os.lseek(fd, _LOCK_OFFSET, os.SEEK_SET)
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                finally:
+                    os.lseek(fd, 0, os.SEEK_SET)
+        except OSError as e:
+            raise JournalLocked(f"Usage journal {self.path} is locked by another process: {e}") from e
+
+    @property
+    def capacity(self):
+        return (len(self._mm) - _HEADER.size) // RECORD_SIZE
+
+    def __len__(self):
+        return self._count
+
+    def _grow(self):
+        """Удваивает файл журнала (переотображая его целиком)."""
+        new_size = _HEADER.size + 2 * self.capacity * RECORD_SIZE
+        self._mm.close()
+        self._file.truncate(new_size)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+    def _sync_range(self, offset, length):
+        if not self._sync:
+            return
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        self._mm.flush(start, offset + length - start)
+
+    def append(self, ts, day, process_name, duration):
+        name = process_name.encode('utf-8')
+        if len(name) > NAME_MAX_BYTES:
+            return None
+        with self._lock:
+            if self._count >= self.capacity:
+                self._grow()
+            self._seq += 1
+            body = _RECORD_BODY.pack(self._epoch, self._seq, ts, day, duration, len(name), name)
+            offset = _HEADER.size + self._count * RECORD_SIZE
+            self._mm[offset:offset + RECORD_SIZE] = body + _CRC.pack(zlib.crc32(body))
+            self._sync_range(offset, RECORD_SIZE)
+            self._count += 1
+            return self._seq
+
+    def committed(self, seq):
+        """Отмечает, что записи до seq включительно зафиксированы в БД."""
+        with self._lock:
+            if self._count and seq >= self._seq:
+                self._reset()
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        # Записи прошлой эпохи при проигрывании считаются недействительными — стирать их не нужно
+        self._epoch = (self._epoch + 1) & 0xFFFFFFFF
+        self._mm[0:_HEADER.size] = _HEADER.pack(_MAGIC, _VERSION, RECORD_SIZE, self._epoch)
+        self._sync_range(0, _HEADER.size)
+        self._count = 0
+
+    def replay(self):
+        """Возвращает список (ts, day, process_name, duration) действительных записей текущей эпохи."""
+        rows = []
+        with self._lock:
+            last_seq = 0
+            for index in range(self.capacity):
+                offset = _HEADER.size + index * RECORD_SIZE
+                record = self._mm[offset:offset + RECORD_SIZE]
+                body, (crc,) = record[:_RECORD_BODY.size], _CRC.unpack(record[_RECORD_BODY.size:])
+                if zlib.crc32(body) != crc:
+                    break
+                epoch, seq, ts, day, duration, name_len, name = _RECORD_BODY.unpack(body)
+                if epoch != self._epoch or seq <= last_seq:
+                    break
+                last_seq = seq
+                rows.append((ts, day, name[:name_len].decode('utf-8', 'replace'), duration))
+            self._count = len(rows)
+            self._seq = last_seq
+        return rows
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+                self._mm.close()
+                self._mm = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
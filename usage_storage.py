@@ -0,0 +1,1059 @@
+"""
+Файл: usage_storage.py
+
+Хранилища статистики использования для ProcessManager в приложении Game Timer.
+SqliteUsageStorage — рабочее хранилище по умолчанию (файл usage_stats.db, WAL).
+MemoryUsageStorage — хранилище в памяти на массивах (array) для тестов, симуляций и бенчмарков;
+повторяет семантику SQLite-версии: замена записи (ts, process_name), дневные агрегаты,
+почасовой уровень, сессии и обслуживание по срокам хранения.
+"""
+
+import bisect
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+import minute_bitmap
+
+# Версия схемы БД статистики (PRAGMA user_version):
+# 0 — исходная схема с текстовым timestamp; 1 — целые epoch-секунды и локальный день YYYYMMDD;
+# 2 — дневные агрегаты usage_daily, поддерживаемые инкрементально при записи;
+# 3 — интервалы сессий sessions, которые ведутся по событиям запуска/остановки процессов;
+# 4 — почасовой уровень usage_hourly для сырых данных старше срока хранения;
+# 5 — поминутные карты usage_minutes (общее время без двойного счёта одновременных игр);
+# 6 — карты пересчитаны по сырым данным с округлением границ до ближайшей минуты
+SCHEMA_VERSION = 6
+
+# Разрыв между соседними записями одного процесса, после которого считается новая сессия
+SESSION_GAP_SECONDS = 15 * 60
+# Перезапуск игры в пределах этого времени продолжает предыдущую сессию (лаунчеры, краш-хендлеры)
+SESSION_MERGE_SECONDS = 60
+
+_SQL_CREATE_USAGE = '''
+    CREATE TABLE IF NOT EXISTS usage_stats (
+        ts INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        process_name TEXT NOT NULL,
+        duration INTEGER NOT NULL,
+        PRIMARY KEY (ts, process_name)
+    )
+'''
+# Покрывающий индекс: диапазон по дню + группировка по процессу без чтения строк таблицы
+_SQL_CREATE_USAGE_DAY_INDEX = '''
+    CREATE INDEX IF NOT EXISTS idx_usage_day_process
+    ON usage_stats(day, process_name, duration)
+'''
+# Дневные агрегаты: обновляются в той же транзакции, что и запись сырых данных
+_SQL_CREATE_DAILY = '''
+    CREATE TABLE IF NOT EXISTS usage_daily (
+        day INTEGER NOT NULL,
+        process_name TEXT NOT NULL,
+        seconds INTEGER NOT NULL DEFAULT 0,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        first_seen INTEGER,
+        last_seen INTEGER,
+        PRIMARY KEY (day, process_name)
+    ) WITHOUT ROWID
+'''
+# Почасовые суммы: в них сворачиваются сырые записи старше usage_retention_days,
+# сами они удаляются через usage_hourly_retention_days (дневные агрегаты хранятся всегда)
+_SQL_CREATE_HOURLY = '''
+    CREATE TABLE IF NOT EXISTS usage_hourly (
+        day INTEGER NOT NULL,
+        process_name TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        seconds INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, process_name, hour)
+    ) WITHOUT ROWID
+'''
+# Поминутные карты: 1440 бит (180 байт) на игру в день, см. minute_bitmap;
+# хранятся столько же, сколько почасовые суммы
+_SQL_CREATE_MINUTES = '''
+    CREATE TABLE IF NOT EXISTS usage_minutes (
+        day INTEGER NOT NULL,
+        process_name TEXT NOT NULL,
+        bits BLOB NOT NULL,
+        PRIMARY KEY (day, process_name)
+    ) WITHOUT ROWID
+'''
+_SQL_MINUTES_ROW = 'SELECT bits FROM usage_minutes WHERE day = ? AND process_name = ?'
+_SQL_UPSERT_MINUTES = 'INSERT OR REPLACE INTO usage_minutes (day, process_name, bits) VALUES (?, ?, ?)'
+_SQL_DAY_MINUTES = 'SELECT process_name, bits FROM usage_minutes WHERE day = ?'
+_SQL_CLEANUP_MINUTES = 'DELETE FROM usage_minutes WHERE day < ?'
+_SQL_REBUILD_MINUTES_DELETE = 'DELETE FROM usage_minutes WHERE day IN (SELECT DISTINCT day FROM usage_stats)'
+_SQL_RAW_SAMPLES = 'SELECT ts, day, process_name, duration FROM usage_stats'
+_SQL_IMPORTED_MINUTES_DELETE = 'DELETE FROM usage_minutes WHERE day IN (SELECT day FROM temp.import_days)'
+_SQL_IMPORTED_SAMPLES = '''
+    SELECT ts, day, process_name, duration FROM usage_stats WHERE day IN (SELECT day FROM temp.import_days)
+'''
+
+# Пересборка агрегатов за дни, по которым есть сырые данные (старые агрегаты без сырых данных сохраняются)
+_SQL_REBUILD_DAILY_DELETE = 'DELETE FROM usage_daily WHERE day IN (SELECT DISTINCT day FROM usage_stats)'
+_SQL_REBUILD_DAILY_INSERT = '''
+    INSERT INTO usage_daily (day, process_name, seconds, sessions, first_seen, last_seen)
+    SELECT day, process_name, SUM(duration), SUM(new_session), MIN(ts), MAX(ts)
+    FROM (
+        SELECT day, process_name, duration, ts,
+               CASE WHEN ts - LAG(ts) OVER w <= ? THEN 0 ELSE 1 END AS new_session
+        FROM usage_stats
+        WINDOW w AS (PARTITION BY day, process_name ORDER BY ts)
+    )
+    GROUP BY day, process_name
+'''
+
+# Сессии: интервалы [start_ts, end_ts]; у открытой сессии end_ts — время последнего подтверждения
+_SQL_CREATE_SESSIONS = '''
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY,
+        process_name TEXT NOT NULL,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL
+    )
+'''
+_SQL_CREATE_SESSIONS_END_INDEX = 'CREATE INDEX IF NOT EXISTS idx_sessions_end ON sessions(end_ts)'
+_SQL_CREATE_SESSIONS_PROCESS_INDEX = 'CREATE INDEX IF NOT EXISTS idx_sessions_process_end ON sessions(process_name, end_ts)'
+# Восстановление сессий из сырых записей схемы 2 по прежней эвристике разрыва
+_SQL_BACKFILL_SESSIONS = '''
+    INSERT INTO sessions (process_name, start_ts, end_ts)
+    SELECT process_name, MIN(ts - duration), MAX(ts)
+    FROM (
+        SELECT process_name, ts, duration,
+               SUM(new_session) OVER (PARTITION BY process_name ORDER BY ts ROWS UNBOUNDED PRECEDING) AS grp
+        FROM (
+            SELECT process_name, ts, duration,
+                   CASE WHEN ts - LAG(ts) OVER (PARTITION BY process_name ORDER BY ts) <= ? THEN 0 ELSE 1 END
+                       AS new_session
+            FROM usage_stats
+        )
+    )
+    GROUP BY process_name, grp
+'''
+
+# Перенос данных из схемы 0: timestamp хранился как локальное время 'YYYY-MM-DD HH:MM:SS'
+_SQL_MIGRATE_V0 = '''
+    INSERT OR REPLACE INTO usage_stats (ts, day, process_name, duration)
+    SELECT CAST(strftime('%s', timestamp, 'utc') AS INTEGER),
+           CAST(strftime('%Y%m%d', timestamp) AS INTEGER),
+           process_name, COALESCE(duration, 0)
+    FROM usage_stats_v0
+    WHERE timestamp IS NOT NULL AND process_name IS NOT NULL
+'''
+
+# SQL-запросы держим константами: sqlite3 кэширует подготовленные выражения
+# по тексту запроса, поэтому повторные вызовы переиспользуют их без повторного разбора.
+# Все фильтры — диапазоны по индексируемому столбцу day (YYYYMMDD), без функций над столбцом
+# Итоги читаются из usage_daily: не больше одной строки на игру за день
+_SQL_DAILY_TOTAL = 'SELECT SUM(seconds) FROM usage_daily WHERE day = ?'
+# Третий параметр — день, исключаемый из выборки (сегодня берётся из счётчиков в памяти)
+_SQL_RANGE_TOTAL = 'SELECT SUM(seconds) FROM usage_daily WHERE day >= ? AND day < ? AND day <> ?'
+_SQL_INSERT_USAGE = 'INSERT OR REPLACE INTO usage_stats (ts, day, process_name, duration) VALUES (?, ?, ?, ?)'
+_SQL_EXISTING_SAMPLE = 'SELECT duration FROM usage_stats WHERE ts = ? AND process_name = ?'
+_SQL_DAILY_ROW = 'SELECT seconds, sessions, first_seen, last_seen FROM usage_daily WHERE day = ? AND process_name = ?'
+_SQL_UPSERT_DAILY = '''
+    INSERT OR REPLACE INTO usage_daily (day, process_name, seconds, sessions, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+_SQL_DAILY_BY_PROCESS = 'SELECT process_name, seconds FROM usage_daily WHERE day = ?'
+_SQL_RANGE_BY_PROCESS = '''
+    SELECT process_name, SUM(seconds) as total
+    FROM usage_daily
+    WHERE day >= ? AND day < ? AND day <> ?
+    GROUP BY process_name
+'''
+# Обслуживание порциями по индексируемому времени: каждая порция — отдельная короткая транзакция.
+# Граница порции сырых записей — ts строки со смещением batch_size
+_SQL_RAW_BATCH_BOUND = 'SELECT ts FROM usage_stats WHERE ts < ? ORDER BY ts LIMIT 1 OFFSET ?'
+# ts сырой записи — конец интервала [ts - duration, ts). Интервал делится по UTC-часам, которые он
+# покрывает, поэтому запись 10:59–11:01 даёт по минуте в 10:00 и 11:00. Записи внутри одного часа
+# (почти все) берутся как есть, рекурсивный CTE режет только пересекающие границу часа — на каждую
+# запись по строке очереди он заметно медленнее. Части разрезанной записи получают местный день своего часа:
+# иначе кусок до полуночи попал бы в usage_hourly под следующим днём рядом с тем же часом под своим
+_HOUR_PARTS_CTE = '''
+    WITH RECURSIVE parts(process_name, start, end) AS (
+        SELECT process_name, ts - duration, ts FROM usage_stats
+        WHERE {where} AND duration > 0 AND ts - duration - (ts - duration) % 3600 + 3600 < ts
+        UNION ALL
+        SELECT process_name, start - start % 3600 + 3600, end FROM parts
+        WHERE start - start % 3600 + 3600 < end
+    ), pieces(day, process_name, hour, seconds) AS (
+        SELECT day, process_name, ts - duration - (ts - duration) % 3600, duration FROM usage_stats
+        WHERE {where} AND duration > 0 AND ts - duration - (ts - duration) % 3600 + 3600 >= ts
+        UNION ALL
+        SELECT CAST(strftime('%Y%m%d', MIN(end, start - start % 3600 + 3600) - 1, 'unixepoch', 'localtime') AS INTEGER),
+               process_name, start - start % 3600, MIN(end, start - start % 3600 + 3600) - start
+        FROM parts
+    )
+'''
+# WHERE true — требование SQLite к INSERT ... SELECT с ON CONFLICT
+_SQL_COMPACT_HOURLY = f'''
+    INSERT INTO usage_hourly (day, process_name, hour, seconds)
+    {_HOUR_PARTS_CTE.format(where='ts < ?1')}
+    SELECT day, process_name, hour, SUM(seconds)
+    FROM pieces
+    WHERE true
+    GROUP BY day, process_name, hour
+    ON CONFLICT (day, process_name, hour) DO UPDATE SET seconds = seconds + excluded.seconds
+'''
+_SQL_DELETE_RAW_BEFORE = 'DELETE FROM usage_stats WHERE ts < ?'
+# Почасовые суммы удаляются по одному (самому старому) дню за шаг
+_SQL_CLEANUP_HOURLY_DAY = 'DELETE FROM usage_hourly WHERE day = (SELECT MIN(day) FROM usage_hourly) AND day < ?'
+_SQL_CLEANUP_SESSIONS_BATCH = 'DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE end_ts < ? LIMIT ?)'
+
+# Почасовая разбивка периода: недавнее — из сырых записей, старое — из usage_hourly (уровни не пересекаются).
+# Записи, закончившиеся позже конца периода (не дальше _MAX_SAMPLE_SECONDS), могут начинаться внутри него
+_MAX_SAMPLE_SECONDS = 86400
+_SQL_RAW_HOURLY = f'''
+    {_HOUR_PARTS_CTE.format(where='ts > ?1 AND ts < ?2')}
+    SELECT hour, SUM(seconds)
+    FROM pieces
+    WHERE hour >= ?1 AND hour < ?3
+    GROUP BY hour
+'''
+_SQL_COMPACTED_HOURLY = '''
+    SELECT hour, SUM(seconds)
+    FROM usage_hourly
+    WHERE day >= ? AND day < ? AND hour >= ? AND hour < ?
+    GROUP BY hour
+'''
+_SQL_LAST_SESSION = 'SELECT id, end_ts FROM sessions WHERE process_name = ? ORDER BY end_ts DESC LIMIT 1'
+_SQL_OPEN_SESSION = 'INSERT INTO sessions (process_name, start_ts, end_ts) VALUES (?, ?, ?)'
+_SQL_TOUCH_SESSION = 'UPDATE sessions SET end_ts = ? WHERE id = ?'
+# Сессии, пересекающие период: индекс по end_ts отсекает всё, что закончилось раньше начала периода
+_SQL_RANGE_SESSIONS = '''
+    SELECT process_name, COUNT(*), MAX(end_ts)
+    FROM sessions
+    WHERE end_ts >= ? AND start_ts < ?
+    GROUP BY process_name
+'''
+# Дневные агрегаты по играм за окно панели статистики (неделя с понедельника ∪ последние 7 дней)
+_SQL_DASHBOARD_DAILY = 'SELECT day, process_name, seconds FROM usage_daily WHERE day >= ? AND day < ? AND day <> ?'
+_SQL_SESSION_INTERVALS = 'SELECT process_name, start_ts, end_ts FROM sessions WHERE end_ts >= ? AND start_ts < ?'
+
+# Выгрузка по уровням: дни, от которых остались только дневные итоги, затем почасовые суммы, затем сырые записи.
+# ts строки — конец интервала, как у сырых записей: свёрнутая строка выгружается с концом своего часа (дня),
+# иначе при загрузке её секунды легли бы в предыдущий час. Отбор по периоду — по началу часа (дня).
+# Один час одной игры может лежать под двумя днями (запись, закончившаяся ровно в полночь; пояса со
+# сдвигом в полчаса) — такие строки сливаются в одну, иначе загрузка заменила бы одну другой по (ts, process_name)
+_SQL_EXPORT_DAILY_ONLY = '''
+    SELECT day, process_name, seconds
+    FROM usage_daily AS d
+    WHERE day >= ? AND day <= ? AND seconds > 0
+      AND NOT EXISTS (SELECT 1 FROM usage_hourly AS h WHERE h.day = d.day AND h.process_name = d.process_name)
+      AND NOT EXISTS (SELECT 1 FROM usage_stats AS s WHERE s.day = d.day AND s.process_name = d.process_name)
+    ORDER BY day, process_name
+'''
+_SQL_EXPORT_HOURLY = '''
+    SELECT hour + 3600, MIN(day), process_name, SUM(seconds)
+    FROM usage_hourly
+    WHERE hour >= ? AND hour < ?
+    GROUP BY hour, process_name
+    ORDER BY hour, process_name
+'''
+_SQL_EXPORT_RAW = '''
+    SELECT ts, day, process_name, duration
+    FROM usage_stats
+    WHERE ts >= ? AND ts < ?
+    ORDER BY ts
+'''
+# Загрузка: дни, уже свёрнутые в usage_hourly, пропускаются (их данные в базе уже есть)
+_SQL_COMPACTED_DAYS = 'SELECT DISTINCT day FROM usage_hourly'
+_SQL_CREATE_IMPORT_DAYS = 'CREATE TEMP TABLE IF NOT EXISTS import_days (day INTEGER PRIMARY KEY)'
+_SQL_INSERT_IMPORT_DAY = 'INSERT OR IGNORE INTO temp.import_days (day) VALUES (?)'
+# Агрегаты загруженных дней пересчитываются по сырым данным один раз в конце транзакции
+_SQL_REBUILD_IMPORTED_DAILY = '''
+    INSERT OR REPLACE INTO usage_daily (day, process_name, seconds, sessions, first_seen, last_seen)
+    SELECT day, process_name, SUM(duration), SUM(new_session), MIN(ts), MAX(ts)
+    FROM (
+        SELECT day, process_name, duration, ts,
+               CASE WHEN ts - LAG(ts) OVER w <= ? THEN 0 ELSE 1 END AS new_session
+        FROM usage_stats
+        WHERE day IN (SELECT day FROM temp.import_days)
+        WINDOW w AS (PARTITION BY day, process_name ORDER BY ts)
+    )
+    GROUP BY day, process_name
+'''
+
+def day_key(value):
+    """Преобразует date/datetime в целочисленный ключ локального дня YYYYMMDD."""
+    return value.year * 10000 + value.month * 100 + value.day
+
+
+def _day_of_ts(ts):
+    return day_key(datetime.fromtimestamp(ts))
+
+
+def _ts_of_day(day):
+    """Начало локального дня YYYYMMDD в epoch-секундах."""
+    return int(datetime(day // 10000, day // 100 % 100, day % 100).timestamp())
+
+
+def _ts_of_day_end(day):
+    """Конец локального дня YYYYMMDD (начало следующего) в epoch-секундах."""
+    return int((datetime(day // 10000, day // 100 % 100, day % 100) + timedelta(days=1)).timestamp())
+
+
+def _hour_parts(ts, duration):
+    """Делит интервал [ts - duration, ts) по UTC-часам: (начало часа, секунды) — как _HOUR_PARTS_CTE."""
+    start = ts - duration
+    hour = start - start % 3600
+    if ts <= hour + 3600:
+        return ((hour, duration),) if duration > 0 else ()
+    return _split_hours(start, ts)
+
+
+def _split_hours(start, ts):
+    while start < ts:
+        hour = start - start % 3600
+        end = min(ts, hour + 3600)
+        yield hour, end - start
+        start = end
+
+
+def _export_bounds(start_ts, end_ts):
+    """Границы выгрузки (None — без ограничения): (start_ts, end_ts, первый день, последний день)."""
+    start_ts = 0 if start_ts is None else start_ts
+    end_ts = 2 ** 62 if end_ts is None else end_ts
+    first_day = _day_of_ts(start_ts) if start_ts > 0 else 0
+    last_day = _day_of_ts(end_ts) if end_ts < 2 ** 62 else 99999999
+    return start_ts, end_ts, first_day, last_day
+
+
+class UsageStorage:
+    """Интерфейс хранилища статистики.
+
+    Запись (из потока-писателя ProcessManager; при старте — проигрывание журнала до запуска писателя):
+    write(samples, session_ops, session_ids) -> атомарно записывает строки (ts, day, name, duration)
+                                                и операции сессий; возвращает новый {name: id сессии}
+    rebuild_rollups()                        -> пересобирает дневные агрегаты, возвращает число строк
+    retention_step(job, batch_size, vacuum_pages) -> один шаг обслуживания; True — проход завершён
+    import_usage(rows, batch_size)           -> загружает строки (ts, day, name, duration) одной транзакцией,
+                                                пропуская уже свёрнутые дни; возвращает (загружено, пропущено, дней)
+    close_writer()                           -> освобождает ресурсы писателя (при его остановке)
+
+    Чтение (из любого потока), дни — ключи YYYYMMDD, excluded — день, не входящий в результат:
+    day_total(day) / range_total(start, end, excluded)            -> секунды
+    day_by_process(day) / range_by_process(start, end, excluded)  -> [(name, seconds)]
+    daily_rows(start, end, excluded)                              -> [(day, name, seconds)]
+    range_sessions(start_ts, end_ts)                              -> [(name, sessions, last_end_ts)]
+    hourly(start_ts, end_ts)                                      -> [(hour_ts, seconds)] по всем уровням
+    day_minutes(day)                                              -> {name: поминутная карта дня (int)}
+    iter_usage(start_ts, end_ts)                                  -> поток (ts, day, name, seconds) по всем
+                                                                     уровням; у свёрнутых данных ts — начало
+                                                                     часа или дня
+    session_intervals(start_ts, end_ts)                           -> [(name, start_ts, end_ts)]
+
+    reset() — удалить все данные, close() — закрыть хранилище.
+    path — файл данных (рядом с ним ProcessManager ведёт журнал) или None.
+    """
+
+    name = 'base'
+    path = None
+
+    def write(self, samples, session_ops, session_ids):
+        raise NotImplementedError
+
+    def rebuild_rollups(self):
+        raise NotImplementedError
+
+    def retention_step(self, job, batch_size, vacuum_pages):
+        raise NotImplementedError
+
+    def import_usage(self, rows, batch_size=5000):
+        raise NotImplementedError
+
+    def close_writer(self):
+        pass
+
+    def day_total(self, day):
+        raise NotImplementedError
+
+    def range_total(self, start, end, excluded=0):
+        raise NotImplementedError
+
+    def day_by_process(self, day):
+        raise NotImplementedError
+
+    def day_minutes(self, day):
+        raise NotImplementedError
+
+    def range_by_process(self, start, end, excluded=0):
+        raise NotImplementedError
+
+    def daily_rows(self, start, end, excluded=0):
+        raise NotImplementedError
+
+    def range_sessions(self, start_ts, end_ts):
+        raise NotImplementedError
+
+    def hourly(self, start_ts, end_ts):
+        raise NotImplementedError
+
+    def iter_usage(self, start_ts=None, end_ts=None):
+        raise NotImplementedError
+
+    def session_intervals(self, start_ts, end_ts):
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SqliteUsageStorage(UsageStorage):
+    """Хранилище в SQLite: соединение для чтения (под блокировкой) и отдельное соединение
+    потока-писателя; WAL позволяет читать, пока идёт запись.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.logger = logging.getLogger('UsageStorage')
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+        self._write_conn = None
+        self._init_db()
+
+    def _connect(self):
+        """Открывает долгоживущее соединение: WAL, таймаут занятости и умеренный кэш страниц."""
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, cached_statements=64)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # в WAL достаточно для целостности, без fsync на каждый commit
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-2048')  # ~2 МБ
+        return conn
+
+    def _get_conn(self):
+        """Возвращает соединение для чтения (открывается лениво). Вызывать под self._lock."""
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _get_write_conn(self):
+        """Соединение потока-писателя (открывается лениво)."""
+        if self._write_conn is None:
+            self._write_conn = self._connect()
+        return self._write_conn
+
+    def _init_db(self):
+        """Инициализация базы данных для статистики (с миграцией старой схемы на месте)"""
+        try:
+            with self._lock:
+                conn = self._get_conn()
+                if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                    # Однократно: освобождение места порциями (PRAGMA incremental_vacuum);
+                    # для уже существующего файла режим вступает в силу только после VACUUM
+                    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                    conn.execute('VACUUM')
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    self._migrate(conn, version)
+                with conn:
+                    conn.execute(_SQL_CREATE_USAGE)
+                    conn.execute(_SQL_CREATE_USAGE_DAY_INDEX)
+                    conn.execute(_SQL_CREATE_DAILY)
+                    conn.execute(_SQL_CREATE_SESSIONS)
+                    conn.execute(_SQL_CREATE_SESSIONS_END_INDEX)
+                    conn.execute(_SQL_CREATE_SESSIONS_PROCESS_INDEX)
+                    conn.execute(_SQL_CREATE_HOURLY)
+                    conn.execute(_SQL_CREATE_MINUTES)
+            self.logger.info(f"Database initialized successfully: {self.path}")
+        except sqlite3.Error as e:
+            self.logger.error(f"Database initialization error: {e}")
+            raise
+
+    def _migrate(self, conn, version):
+        """Переводит БД на текущую схему одной транзакцией."""
+        started = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version < 1:
+                columns = [row[1] for row in conn.execute('PRAGMA table_info(usage_stats)')]
+                if 'timestamp' in columns:
+                    conn.execute('ALTER TABLE usage_stats RENAME TO usage_stats_v0')
+                    conn.execute(_SQL_CREATE_USAGE)
+                    conn.execute(_SQL_MIGRATE_V0)
+                    conn.execute('DROP TABLE usage_stats_v0')
+            if version < 2:
+                conn.execute(_SQL_CREATE_USAGE)
+                conn.execute(_SQL_CREATE_DAILY)
+                conn.execute(_SQL_CREATE_MINUTES)
+                self._rebuild_rollups(conn)
+            if version < 3:
+                conn.execute(_SQL_CREATE_USAGE)
+                conn.execute(_SQL_CREATE_SESSIONS)
+                conn.execute(_SQL_BACKFILL_SESSIONS, (SESSION_GAP_SECONDS,))
+            if version < 4:
+                conn.execute(_SQL_CREATE_HOURLY)
+            if 2 <= version < 6:
+                # Для схем старше 2 карты уже построены в _rebuild_rollups
+                conn.execute(_SQL_CREATE_MINUTES)
+                conn.execute(_SQL_REBUILD_MINUTES_DELETE)
+                self._apply_minutes(conn, conn.execute(_SQL_RAW_SAMPLES))
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.logger.info(f"Database migrated from schema {version} to {SCHEMA_VERSION} in {time.time() - started:.2f}s")
+
+    def _rebuild_rollups(self, conn):
+        """Пересчитывает usage_daily и usage_minutes по сырым данным (внутри уже открытой транзакции)."""
+        conn.execute(_SQL_REBUILD_DAILY_DELETE)
+        conn.execute(_SQL_REBUILD_DAILY_INSERT, (SESSION_GAP_SECONDS,))
+        conn.execute(_SQL_REBUILD_MINUTES_DELETE)
+        self._apply_minutes(conn, conn.execute(_SQL_RAW_SAMPLES))
+
+    def _apply_minutes(self, conn, samples):
+        """Добавляет (ИЛИ) минуты строк (ts, day, name, duration) к картам usage_minutes в текущей транзакции.
+        Строки читаются целиком до первой записи, поэтому samples может быть курсором того же соединения.
+        """
+        for (day, name), bits in minute_bitmap.collect(samples).items():
+            row = conn.execute(_SQL_MINUTES_ROW, (day, name)).fetchone()
+            if row is not None:
+                bits |= minute_bitmap.from_bytes(row[0])
+            conn.execute(_SQL_UPSERT_MINUTES, (day, name, minute_bitmap.to_bytes(bits)))
+
+    def rebuild_rollups(self):
+        conn = self._get_write_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._rebuild_rollups(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return conn.execute('SELECT COUNT(*) FROM usage_daily').fetchone()[0]
+
+    def _apply_rollups(self, conn, samples):
+        """Записывает сырые строки и обновляет usage_daily в текущей транзакции.
+        Повторная запись той же (ts, process_name) заменяет строку — в агрегат идёт только разница.
+        """
+        rollups = {}
+        # Сортировка только по времени (стабильная): при повторе (ts, process_name) побеждает последняя запись
+        for ts, day, name, duration in sorted(samples, key=lambda row: row[0]):
+            existing = conn.execute(_SQL_EXISTING_SAMPLE, (ts, name)).fetchone()
+            conn.execute(_SQL_INSERT_USAGE, (ts, day, name, duration))
+            key = (day, name)
+            row = rollups.get(key)
+            if row is None:
+                found = conn.execute(_SQL_DAILY_ROW, key).fetchone()
+                row = rollups[key] = list(found) if found else [0, 0, None, None]
+            if existing is not None:
+                row[0] += duration - (existing[0] or 0)
+                continue
+            row[0] += duration
+            if row[3] is None or ts - row[3] > SESSION_GAP_SECONDS:
+                row[1] += 1
+            row[2] = ts if row[2] is None else min(row[2], ts)
+            row[3] = ts if row[3] is None else max(row[3], ts)
+        conn.executemany(_SQL_UPSERT_DAILY, [(day, name, *row) for (day, name), row in rollups.items()])
+
+    def write(self, samples, session_ops, session_ids):
+        conn = self._get_write_conn()
+        session_ids = dict(session_ids)
+        try:
+            if samples:
+                self._apply_rollups(conn, samples)
+                self._apply_minutes(conn, samples)
+            for kind, payload in session_ops:
+                if kind == 'session_open':
+                    self._write_session_open(conn, session_ids, *payload)
+                elif kind == 'session_close':
+                    name, ts = payload
+                    session_id = session_ids.pop(name, None)
+                    if session_id is not None:
+                        conn.execute(_SQL_TOUCH_SESSION, (ts, session_id))
+                elif kind == 'session_touch':
+                    names, ts = payload
+                    conn.executemany(_SQL_TOUCH_SESSION,
+                                     [(ts, session_ids[name]) for name in names if name in session_ids])
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self.close_writer()
+            raise
+        return session_ids
+
+    def _write_session_open(self, conn, session_ids, name, ts):
+        if name in session_ids:
+            return
+        last = conn.execute(_SQL_LAST_SESSION, (name,)).fetchone()
+        if last is not None and ts - last[1] <= SESSION_MERGE_SECONDS:
+            session_ids[name] = last[0]
+            conn.execute(_SQL_TOUCH_SESSION, (ts, last[0]))
+        else:
+            session_ids[name] = conn.execute(_SQL_OPEN_SESSION, (name, ts, ts)).lastrowid
+
+    def retention_step(self, job, batch_size, vacuum_pages):
+        """Один шаг обслуживания: порция сырых записей сворачивается в почасовые суммы, затем удаляется
+        самый старый день почасовых сумм, затем порция старых сессий, затем incremental_vacuum.
+        Каждый шаг — отдельная короткая транзакция. Возвращает True, когда проход завершён.
+        """
+        conn = self._get_write_conn()
+        phase = job['phase']
+        if phase == 'usage_stats':
+            cutoff = job['raw_cutoff']
+            bound = conn.execute(_SQL_RAW_BATCH_BOUND, (cutoff, batch_size)).fetchone()
+            limit = cutoff if bound is None else min(cutoff, bound[0] + 1)
+            with conn:
+                conn.execute(_SQL_COMPACT_HOURLY, (limit,))
+                job['usage_rows'] += conn.execute(_SQL_DELETE_RAW_BEFORE, (limit,)).rowcount
+            if bound is None:
+                job['phase'] = 'usage_hourly'
+            return False
+        if phase == 'usage_hourly':
+            deleted = 0
+            if job['hourly_cutoff'] is not None:
+                with conn:
+                    deleted = conn.execute(_SQL_CLEANUP_HOURLY_DAY, (job['hourly_cutoff'],)).rowcount
+                job['hourly_rows'] += deleted
+            if not deleted:
+                if job['hourly_cutoff'] is not None:
+                    with conn:
+                        conn.execute(_SQL_CLEANUP_MINUTES, (job['hourly_cutoff'],))
+                job['phase'] = 'sessions' if job['raw_cutoff'] is not None else 'vacuum'
+            return False
+        if phase == 'sessions':
+            with conn:
+                deleted = conn.execute(_SQL_CLEANUP_SESSIONS_BATCH, (job['raw_cutoff'], batch_size)).rowcount
+            job['session_rows'] += deleted
+            if deleted < batch_size:
+                job['phase'] = 'vacuum'
+            return False
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if free_pages:
+            # executescript выполняет прагму до конца (execute освобождает одну страницу за шаг)
+            conn.executescript(f'PRAGMA incremental_vacuum({vacuum_pages});')
+            job['pages_freed'] += min(free_pages, vacuum_pages)
+            return False
+        return True
+
+    def _query(self, sql, params):
+        with self._lock:
+            return self._get_conn().execute(sql, params).fetchall()
+
+    def day_total(self, day):
+        rows = self._query(_SQL_DAILY_TOTAL, (day,))
+        return int(rows[0][0] or 0) if rows else 0
+
+    def range_total(self, start, end, excluded=0):
+        rows = self._query(_SQL_RANGE_TOTAL, (start, end, excluded))
+        return int(rows[0][0] or 0) if rows else 0
+
+    def day_by_process(self, day):
+        return [(name, int(seconds or 0)) for name, seconds in self._query(_SQL_DAILY_BY_PROCESS, (day,))]
+
+    def day_minutes(self, day):
+        return {name: minute_bitmap.from_bytes(bits) for name, bits in self._query(_SQL_DAY_MINUTES, (day,))}
+
+    def range_by_process(self, start, end, excluded=0):
+        rows = self._query(_SQL_RANGE_BY_PROCESS, (start, end, excluded))
+        return [(name, int(seconds or 0)) for name, seconds in rows]
+
+    def daily_rows(self, start, end, excluded=0):
+        return self._query(_SQL_DASHBOARD_DAILY, (start, end, excluded))
+
+    def range_sessions(self, start_ts, end_ts):
+        return self._query(_SQL_RANGE_SESSIONS, (start_ts, end_ts))
+
+    def session_intervals(self, start_ts, end_ts):
+        return self._query(_SQL_SESSION_INTERVALS, (start_ts, end_ts))
+
+    def hourly(self, start_ts, end_ts):
+        rows = self._query(_SQL_RAW_HOURLY, (start_ts, end_ts + _MAX_SAMPLE_SECONDS, end_ts))
+        rows += self._query(_SQL_COMPACTED_HOURLY,
+                            (_day_of_ts(start_ts), _day_of_ts(end_ts) + 1, start_ts, end_ts))
+        merged = {}
+        for hour, seconds in rows:
+            merged[hour] = merged.get(hour, 0) + int(seconds or 0)
+        return sorted(merged.items())
+
+    def iter_usage(self, start_ts=None, end_ts=None):
+        """Потоковая выгрузка через курсоры отдельного соединения: одна читающая транзакция
+        (согласованный снимок в WAL), запросы к базе из других потоков не блокируются.
+        """
+        start_ts, end_ts, first_day, last_day = _export_bounds(start_ts, end_ts)
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        try:
+            conn.execute('BEGIN')
+            for day, name, seconds in conn.execute(_SQL_EXPORT_DAILY_ONLY, (first_day, last_day)):
+                if start_ts <= _ts_of_day(day) < end_ts:
+                    yield _ts_of_day_end(day), day, name, seconds
+            yield from conn.execute(_SQL_EXPORT_HOURLY, (start_ts, end_ts))
+            yield from conn.execute(_SQL_EXPORT_RAW, (start_ts, end_ts))
+        finally:
+            conn.close()
+
+    def import_usage(self, rows, batch_size=5000):
+        """Загружает строки пачками executemany в одной транзакции; агрегаты загруженных дней
+        пересчитываются в конце. Повтор (ts, process_name) заменяет строку, поэтому загрузка идемпотентна.
+        """
+        conn = self._get_write_conn()
+        compacted = {day for (day,) in conn.execute(_SQL_COMPACTED_DAYS)}
+        conn.execute(_SQL_CREATE_IMPORT_DAYS)
+        imported = skipped = 0
+        days = set()
+        rows = iter(rows)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM temp.import_days')
+            while True:
+                chunk = list(itertools.islice(rows, batch_size))
+                if not chunk:
+                    break
+                batch = [row for row in chunk if row[1] not in compacted]
+                skipped += len(chunk) - len(batch)
+                conn.executemany(_SQL_INSERT_USAGE, batch)
+                new_days = {row[1] for row in batch} - days
+                if new_days:
+                    conn.executemany(_SQL_INSERT_IMPORT_DAY, [(day,) for day in new_days])
+                    days |= new_days
+                imported += len(batch)
+            if days:
+                conn.execute(_SQL_REBUILD_IMPORTED_DAILY, (SESSION_GAP_SECONDS,))
+                conn.execute(_SQL_IMPORTED_MINUTES_DELETE)
+                self._apply_minutes(conn, conn.execute(_SQL_IMPORTED_SAMPLES))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return imported, skipped, len(days)
+
+    def close_writer(self):
+        if self._write_conn is None:
+            return
+        try:
+            self._write_conn.execute('PRAGMA optimize')
+            self._write_conn.close()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error closing writer connection: {e}")
+        self._write_conn = None
+
+    def close(self):
+        self.close_writer()
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.execute('PRAGMA optimize')
+                    self._conn.close()
+                except sqlite3.Error as e:
+                    self.logger.error(f"Error closing database: {e}")
+                self._conn = None
+
+    def reset(self):
+        """Удаляет файл БД (вместе с WAL/SHM) и создаёт пустую. Писатель должен быть остановлен."""
+        self.close_writer()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            for suffix in ('', '-wal', '-shm'):
+                path = self.path + suffix
+                if os.path.exists(path):
+                    os.remove(path)
+        self._init_db()
+
+
+class MemoryUsageStorage(UsageStorage):
+    """Хранилище в памяти. Сырые записи — столбцы array, упорядоченные по ts;
+    агрегаты — словари. Ничего не пишет на диск, журнал для него не ведётся.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._ts = array('q')
+            self._day = array('l')
+            self._name_id = array('l')
+            self._duration = array('q')
+            self._names = []
+            self._name_ids = {}
+            self._daily = {}  # (day, name) -> [seconds, sessions, first_seen, last_seen]
+            self._hourly = {}  # (day, name, hour) -> seconds
+            self._minutes = {}  # (day, name) -> поминутная карта (int)
+            self._sessions = {}  # id -> [id, name, start_ts, end_ts]
+            self._last_session = {}  # name -> последняя по времени сессия
+            self._next_session_id = 1
+
+    def __len__(self):
+        return len(self._ts)
+
+    def _intern(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        return name_id
+
+    def _upsert_sample(self, ts, day, name_id, duration):
+        """Вставляет строку с сохранением порядка по ts; возвращает прежнюю длительность при замене."""
+        lo = bisect.bisect_left(self._ts, ts)
+        hi = len(self._ts)
+        index = lo
+        while index < hi and self._ts[index] == ts:
+            if self._name_id[index] == name_id:
+                previous = self._duration[index]
+                self._duration[index] = duration
+                return previous
+            index += 1
+        self._ts.insert(index, ts)
+        self._day.insert(index, day)
+        self._name_id.insert(index, name_id)
+        self._duration.insert(index, duration)
+        return None
+
+    def write(self, samples, session_ops, session_ids):
+        with self._lock:
+            for ts, day, name, duration in sorted(samples, key=lambda row: row[0]):
+                existing = self._upsert_sample(ts, day, self._intern(name), duration)
+                row = self._daily.setdefault((day, name), [0, 0, None, None])
+                if existing is not None:
+                    row[0] += duration - existing
+                    continue
+                row[0] += duration
+                if row[3] is None or ts - row[3] > SESSION_GAP_SECONDS:
+                    row[1] += 1
+                row[2] = ts if row[2] is None else min(row[2], ts)
+                row[3] = ts if row[3] is None else max(row[3], ts)
+            self._merge_minutes(minute_bitmap.collect(samples))
+            session_ids = dict(session_ids)
+            for kind, payload in session_ops:
+                if kind == 'session_open':
+                    name, ts = payload
+                    if name in session_ids:
+                        continue
+                    last = self._last_session.get(name)
+                    if last is not None and last[0] in self._sessions and ts - last[3] <= SESSION_MERGE_SECONDS:
+                        last[3] = ts
+                        session_ids[name] = last[0]
+                    else:
+                        session = [self._next_session_id, name, ts, ts]
+                        self._next_session_id += 1
+                        self._sessions[session[0]] = session
+                        self._last_session[name] = session
+                        session_ids[name] = session[0]
+                elif kind == 'session_close':
+                    name, ts = payload
+                    session = self._sessions.get(session_ids.pop(name, None))
+                    if session is not None:
+                        session[3] = ts
+                elif kind == 'session_touch':
+                    names, ts = payload
+                    for name in names:
+                        session = self._sessions.get(session_ids.get(name))
+                        if session is not None:
+                            session[3] = ts
+            return session_ids
+
+    def _rollups_from_raw(self, days=None):
+        """Дневные агрегаты по сырым строкам (только за days, если заданы)."""
+        rebuilt = {}
+        for i in range(len(self._ts)):
+            ts, day = self._ts[i], self._day[i]
+            if days is not None and day not in days:
+                continue
+            row = rebuilt.setdefault((day, self._names[self._name_id[i]]), [0, 0, None, None])
+            row[0] += self._duration[i]
+            if row[3] is None or ts - row[3] > SESSION_GAP_SECONDS:
+                row[1] += 1
+            row[2] = ts if row[2] is None else row[2]
+            row[3] = ts
+        return rebuilt
+
+    def _merge_minutes(self, bitmaps):
+        for key, bits in bitmaps.items():
+            self._minutes[key] = self._minutes.get(key, 0) | bits
+
+    def _raw_samples(self, days=None):
+        for i in range(len(self._ts)):
+            if days is None or self._day[i] in days:
+                yield self._ts[i], self._day[i], self._names[self._name_id[i]], self._duration[i]
+
+    def rebuild_rollups(self):
+        with self._lock:
+            raw_days = set(self._day)
+            self._daily = {key: row for key, row in self._daily.items() if key[0] not in raw_days}
+            self._daily.update(self._rollups_from_raw())
+            self._minutes = {key: bits for key, bits in self._minutes.items() if key[0] not in raw_days}
+            self._merge_minutes(minute_bitmap.collect(self._raw_samples()))
+            return len(self._daily)
+
+    def import_usage(self, rows, batch_size=5000):
+        """Загружает строки одним слиянием с уже имеющимися (вместо вставки по одной в середину массивов)."""
+        with self._lock:
+            compacted = {key[0] for key in self._hourly}
+            merged = {}
+            for i in range(len(self._ts)):
+                merged[(self._ts[i], self._name_id[i])] = (self._day[i], self._duration[i])
+            imported = skipped = 0
+            days = set()
+            for ts, day, name, duration in rows:
+                if day in compacted:
+                    skipped += 1
+                    continue
+                merged[(ts, self._intern(name))] = (day, duration)
+                days.add(day)
+                imported += 1
+            if not imported:
+                return 0, skipped, 0
+            keys = sorted(merged)
+            self._ts = array('q', (ts for ts, _ in keys))
+            self._name_id = array('l', (name_id for _, name_id in keys))
+            self._day = array('l', (merged[key][0] for key in keys))
+            self._duration = array('q', (merged[key][1] for key in keys))
+            self._daily.update(self._rollups_from_raw(days))
+            self._minutes = {key: bits for key, bits in self._minutes.items() if key[0] not in days}
+            self._merge_minutes(minute_bitmap.collect(self._raw_samples(days)))
+            return imported, skipped, len(days)
+
+    def retention_step(self, job, batch_size, vacuum_pages):
+        with self._lock:
+            phase = job['phase']
+            if phase == 'usage_stats':
+                count = min(bisect.bisect_left(self._ts, job['raw_cutoff']), batch_size)
+                for i in range(count):
+                    ts, day, name, duration = self._ts[i], self._day[i], self._names[self._name_id[i]], self._duration[i]
+                    for hour, seconds in _hour_parts(ts, duration):
+                        if seconds != duration:
+                            day = _day_of_ts(min(ts, hour + 3600) - 1)
+                        key = (day, name, hour)
+                        self._hourly[key] = self._hourly.get(key, 0) + seconds
+                for column in (self._ts, self._day, self._name_id, self._duration):
+                    del column[:count]
+                job['usage_rows'] += count
+                if count < batch_size:
+                    job['phase'] = 'usage_hourly'
+                return False
+            if phase == 'usage_hourly':
+                if job['hourly_cutoff'] is not None:
+                    stale = [key for key in self._hourly if key[0] < job['hourly_cutoff']]
+                    for key in stale:
+                        del self._hourly[key]
+                    job['hourly_rows'] += len(stale)
+                    self._minutes = {key: bits for key, bits in self._minutes.items()
+                                     if key[0] >= job['hourly_cutoff']}
+                job['phase'] = 'sessions' if job['raw_cutoff'] is not None else 'vacuum'
+                return False
+            if phase == 'sessions':
+                stale = [sid for sid, s in self._sessions.items() if s[3] < job['raw_cutoff']]
+                for sid in stale:
+                    del self._sessions[sid]
+                job['session_rows'] += len(stale)
+                job['phase'] = 'vacuum'
+                return False
+            return True
+
+    def day_total(self, day):
+        with self._lock:
+            return sum(row[0] for (d, _), row in self._daily.items() if d == day)
+
+    def range_total(self, start, end, excluded=0):
+        with self._lock:
+            return sum(row[0] for (d, _), row in self._daily.items() if start <= d < end and d != excluded)
+
+    def day_by_process(self, day):
+        with self._lock:
+            return [(name, row[0]) for (d, name), row in self._daily.items() if d == day]
+
+    def day_minutes(self, day):
+        with self._lock:
+            return {name: bits for (d, name), bits in self._minutes.items() if d == day}
+
+    def range_by_process(self, start, end, excluded=0):
+        totals = {}
+        with self._lock:
+            for (d, name), row in self._daily.items():
+                if start <= d < end and d != excluded:
+                    totals[name] = totals.get(name, 0) + row[0]
+        return list(totals.items())
+
+    def daily_rows(self, start, end, excluded=0):
+        with self._lock:
+            return [(d, name, row[0]) for (d, name), row in self._daily.items() if start <= d < end and d != excluded]
+
+    def range_sessions(self, start_ts, end_ts):
+        found = {}
+        with self._lock:
+            for _, name, start, end in self._sessions.values():
+                if end >= start_ts and start < end_ts:
+                    count, last = found.get(name, (0, end))
+                    found[name] = (count + 1, max(last, end))
+        return [(name, count, last) for name, (count, last) in found.items()]
+
+    def session_intervals(self, start_ts, end_ts):
+        with self._lock:
+            return [(name, start, end) for _, name, start, end in self._sessions.values()
+                    if end >= start_ts and start < end_ts]
+
+    def hourly(self, start_ts, end_ts):
+        merged = {}
+        with self._lock:
+            lo = bisect.bisect_right(self._ts, start_ts)
+            hi = bisect.bisect_left(self._ts, end_ts + _MAX_SAMPLE_SECONDS)
+            ts_col, duration_col = self._ts, self._duration
+            for i in range(lo, hi):
+                ts, duration = ts_col[i], duration_col[i]
+                start = ts - duration
+                hour = start - start % 3600
+                if ts <= hour + 3600:
+                    # Обычный случай — запись внутри одного часа
+                    if duration > 0 and start_ts <= hour < end_ts:
+                        merged[hour] = merged.get(hour, 0) + duration
+                    continue
+                for hour, seconds in _hour_parts(ts, duration):
+                    if start_ts <= hour < end_ts:
+                        merged[hour] = merged.get(hour, 0) + seconds
+            for (_, _, hour), seconds in self._hourly.items():
+                if start_ts <= hour < end_ts:
+                    merged[hour] = merged.get(hour, 0) + seconds
+        return sorted(merged.items())
+
+    def iter_usage(self, start_ts=None, end_ts=None):
+        start_ts, end_ts, first_day, last_day = _export_bounds(start_ts, end_ts)
+        with self._lock:
+            detailed = {(day, name) for day, name, _ in self._hourly}
+            detailed.update((self._day[i], self._names[self._name_id[i]]) for i in range(len(self._ts)))
+            daily_only = sorted((day, name, row[0]) for (day, name), row in self._daily.items()
+                                if first_day <= day <= last_day and row[0] > 0 and (day, name) not in detailed)
+            hourly = {}
+            for (day, name, hour), seconds in self._hourly.items():
+                if start_ts <= hour < end_ts:
+                    known_day, total = hourly.get((hour, name), (day, 0))
+                    hourly[(hour, name)] = (min(known_day, day), total + seconds)
+            hourly = sorted((hour + 3600, day, name, seconds) for (hour, name), (day, seconds) in hourly.items())
+            lo = bisect.bisect_left(self._ts, start_ts)
+            hi = bisect.bisect_left(self._ts, end_ts)
+            raw = (self._ts[lo:hi], self._day[lo:hi], self._name_id[lo:hi], self._duration[lo:hi])
+            names = list(self._names)
+        for day, name, seconds in daily_only:
+            if start_ts <= _ts_of_day(day) < end_ts:
+                yield _ts_of_day_end(day), day, name, seconds
+        yield from hourly
+        for ts, day, name_id, duration in zip(*raw):
+            yield ts, day, names[name_id], duration
+
+
+def create_usage_storage(kind=None, path='usage_stats.db'):
+    """Создаёт хранилище по имени из настроек: 'sqlite' (по умолчанию) или 'memory'."""
+    kind = (kind or 'sqlite').strip().lower()
+    if kind == 'memory':
+        return MemoryUsageStorage()
+    if kind != 'sqlite':
+        logging.getLogger('UsageStorage').warning(f"Unknown usage storage '{kind}', using sqlite")
+    return SqliteUsageStorage(path)
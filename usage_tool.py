@@ -0,0 +1,80 @@
+"""
+Файл: usage_tool.py
+
+Служебные команды для базы статистики usage_stats.db приложения Game Timer.
+Приложение должно быть закрыто: его кэш запросов и счётчики текущего дня не узнают
+об изменениях, сделанных утилитой. Пока приложение держит журнал статистики, утилита не запускается.
+
+Запуск:
+    python usage_tool.py rebuild-rollups
+    python usage_tool.py cleanup
+    python usage_tool.py export usage.csv --start 2024-01-01 --end 2024-02-01
+    python usage_tool.py import usage.jsonl
+"""
+
+import argparse
+
+from process_manager import ProcessManager
+from settings_manager import SettingsManager
+
+
+def cmd_rebuild_rollups(manager, args):
+    rows = manager.rebuild_rollups()
+    print(f"Daily rollups rebuilt: {rows} rows")
+
+
+def cmd_cleanup(manager, args):
+    report = manager.cleanup_old_data()
+    if report is None:
+        print("Retention is disabled (usage_retention_days = 0) or cleanup failed")
+        return
+    print(f"Compacted {report['usage_rows']} usage rows into hourly buckets, removed {report['hourly_rows']} "
+          f"hourly rows and {report['session_rows']} sessions, freed {report['pages_freed']} pages "
+          f"in {report['seconds']:.2f}s")
+
+
+def cmd_export(manager, args):
+    count = manager.export_usage(args.path, args.start, args.end, args.format)
+    if count is None:
+        raise SystemExit("Export failed, see logs")
+    print(f"Exported {count} rows to {args.path}")
+
+
+def cmd_import(manager, args):
+    report = manager.import_usage(args.path, args.format)
+    if report is None:
+        raise SystemExit("Import failed, see logs")
+    print(f"Imported {report['rows']} rows for {report['days']} days ({report['skipped']} skipped as already "
+          f"compacted, {report['invalid']} invalid) in {report['seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обслуживание базы статистики Game Timer")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild-rollups', help='пересобрать дневные агрегаты usage_daily из сырых данных')
+    sub.add_parser('cleanup', help='свернуть и удалить старые записи по настройкам хранения и освободить место')
+    export = sub.add_parser('export', help='выгрузить статистику в CSV или JSON Lines')
+    export.add_argument('path', help='файл .csv или .jsonl')
+    export.add_argument('--start', help='первый день периода, YYYY-MM-DD')
+    export.add_argument('--end', help='день после последнего, YYYY-MM-DD')
+    export.add_argument('--format', choices=['csv', 'jsonl'], help='по умолчанию — по расширению файла')
+    load = sub.add_parser('import', help='загрузить статистику из файла выгрузки')
+    load.add_argument('path', help='файл .csv или .jsonl')
+    load.add_argument('--format', choices=['csv', 'jsonl'], help='по умолчанию — по расширению файла')
+    args = parser.parse_args()
+
+    commands = {
+        'rebuild-rollups': cmd_rebuild_rollups,
+        'cleanup': cmd_cleanup,
+        'export': cmd_export,
+        'import': cmd_import,
+    }
+    # Журнал открывается монопольно: если он занят, приложение запущено и работать с базой нельзя.
+    # Свободный журнал утилита проигрывает в базу (записи после аварийного выхода приложения)
+    manager = ProcessManager(SettingsManager())
+    try:
+        if manager.journal_in_use:
+            raise SystemExit("Game Timer is running: close it before using usage_tool")
+        commands[args.command](manager, args)
+    finally:
+        manager.close()
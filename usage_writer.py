@@ -0,0 +1,216 @@
+"""
+Файл: usage_writer.py
+
+Фоновая запись статистики для ProcessManager в приложении Game Timer.
+Поток GUI только кладёт записи в ограниченную очередь; отдельный поток-писатель
+группирует их в транзакции хранилища по размеру и возрасту пачки.
+Если диск не успевает и очередь заполнена, отправитель ждёт (обратное давление).
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+# Служебные операции очереди (не данные)
+_CALL = '_call'
+_FLUSH = '_flush'
+_STOP = '_stop'
+_WAKE = '_wake'
+
+
+class UsageWriter:
+    """Поток-писатель с ограниченной очередью.
+
+    apply(batch)            -> атомарно записывает пачку [(kind, payload), ...];
+                               может вернуть callable, вызываемый после успешной записи
+    close()                 -> освобождает ресурсы хранилища, принадлежащие писателю (при остановке)
+    batch_size              -> пачка фиксируется, как только в ней столько записей
+    max_delay               -> возраст пачки по умолчанию (у отдельной записи может быть меньше)
+
+    Фоновое обслуживание (schedule) выполняется по шагам, только когда очередь пуста,
+    поэтому запись статистики никогда не ждёт его окончания.
+    """
+
+    def __init__(self, apply, close=None, batch_size=100, max_delay=300.0, queue_size=1000,
+                 put_timeout=2.0, retries=3):
+        self.logger = logging.getLogger('UsageWriter')
+        self._apply = apply
+        self._close = close
+        self._batch_size = max(1, int(batch_size))
+        self._max_delay = max(0.0, float(max_delay))
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._put_timeout = put_timeout
+        self._retries = max(1, int(retries))
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._idle_jobs = deque()
+        self.committed = 0  # записано записей
+        self.batches = 0  # зафиксировано транзакций
+        self.dropped = 0  # потеряно записей (очередь переполнена или БД недоступна)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    def pending(self):
+        """Приблизительное число операций в очереди."""
+        return self._queue.qsize()
+
+    def start(self):
+        with self._start_lock:
+            if self.is_running():
+                return
+            self._thread = threading.Thread(target=self._run, name='UsageWriter', daemon=True)
+            self._thread.start()
+
+    def submit(self, kind, payload, delay=None):
+        """Ставит запись в очередь. delay — максимальная задержка записи в секундах.
+        При заполненной очереди ждёт до put_timeout; возвращает False, если запись пришлось отбросить.
+        """
+        self.start()
+        delay = self._max_delay if delay is None else min(delay, self._max_delay)
+        try:
+            self._queue.put((kind, payload, delay), timeout=self._put_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            self.logger.error(f"Write queue is full, dropping {kind} record")
+            return False
+
+    def call(self, fn, wait=True, timeout=None):
+        """Выполняет fn() в потоке писателя после уже поставленных записей.
+        При wait=True возвращает результат fn (исключение пробрасывается вызывающему).
+        """
+        if self.is_writer_thread():
+            return fn()
+        done = threading.Event()
+        outcome = [None, None]  # [результат, исключение]
+        self.start()
+        self._queue.put((_CALL, (fn, done, outcome), 0.0))
+        if not wait:
+            return None
+        if not done.wait(timeout):
+            raise TimeoutError("Usage writer did not finish the job in time")
+        if outcome[1] is not None:
+            raise outcome[1]
+        return outcome[0]
+
+    def schedule(self, step):
+        """Ставит фоновую задачу: step() вызывается, пока очередь пуста;
+        возвращает True, если задаче нужен ещё один шаг.
+        """
+        self._idle_jobs.append(step)
+        self.start()
+        try:
+            self._queue.put_nowait((_WAKE, None, 0.0))
+        except queue.Full:
+            pass  # писатель и так занят и дойдёт до задачи, когда разберёт очередь
+
+    def flush(self, timeout=5.0):
+        """Ждёт, пока все поставленные до вызова записи будут зафиксированы. False — не успели за timeout."""
+        if not self.is_running():
+            return self._queue.empty()
+        done = threading.Event()
+        try:
+            self._queue.put((_FLUSH, done, 0.0), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stop(self, timeout=5.0):
+        """Записывает всё поставленное в очередь, освобождает ресурсы писателя и завершает поток."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put((_STOP, done, 0.0), timeout=timeout)
+        except queue.Full:
+            return False
+        thread.join(timeout)
+        stopped = not thread.is_alive()
+        if stopped:
+            self._thread = None
+        return stopped
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            if self._idle_jobs:
+                timeout = 0.0
+            try:
+                kind, payload, delay = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                if self._idle_jobs and (not batch or deadline > time.monotonic()):
+                    self._run_idle_step()
+                    continue
+                kind = None
+            if kind == _WAKE:
+                continue
+            if kind is not None and not kind.startswith('_'):
+                batch.append((kind, payload))
+                due = time.monotonic() + delay
+                deadline = due if deadline is None else min(deadline, due)
+                if len(batch) < self._batch_size and due > time.monotonic():
+                    continue
+            # Пачка фиксируется по размеру, возрасту или перед служебной операцией
+            if batch:
+                self._commit(batch)
+                batch = []
+                deadline = None
+            if kind == _CALL:
+                fn, done, outcome = payload
+                try:
+                    outcome[0] = fn()
+                except Exception as e:
+                    outcome[1] = e
+                    self.logger.error(f"Usage writer job failed: {e}")
+                done.set()
+            elif kind == _FLUSH:
+                payload.set()
+            elif kind == _STOP:
+                self._release()
+                payload.set()
+                return
+
+    def _run_idle_step(self):
+        step = self._idle_jobs.popleft()
+        try:
+            again = step()
+        except Exception as e:
+            self.logger.error(f"Usage writer maintenance step failed: {e}")
+            again = False
+        if again:
+            self._idle_jobs.append(step)
+
+    def _commit(self, batch):
+        for attempt in range(self._retries):
+            try:
+                after_commit = self._apply(batch)
+                if after_commit is not None:
+                    after_commit()
+                self.committed += len(batch)
+                self.batches += 1
+                self.logger.debug(f"Committed {len(batch)} records")
+                return True
+            except Exception as e:
+                self.logger.error(f"Error writing {len(batch)} records (attempt {attempt + 1}): {e}")
+                # Диск занят или медленный: пауза, пока очередь копится и сдерживает отправителей
+                time.sleep(min(5.0, 0.5 * 2 ** attempt))
+        self.dropped += len(batch)
+        self.logger.error(f"Dropping {len(batch)} records after {self._retries} failed attempts")
+        return False
+
+    def _release(self):
+        if self._close is None:
+            return
+        try:
+            self._close()
+        except Exception as e:
+            self.logger.error(f"Error releasing writer resources: {e}")